@@ -0,0 +1,88 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Decoder state at instruction cycle boundaries.
+#
+# Between two instruction cycles, all a decoder needs to carry on is the
+# end of the last S-state read, the PHI1 lock (see clock.py), the
+# EXT/IRG/IO words (s15 of the last cycle goes into the next words), the
+# mode and the start of the last cycle (for the cycle time). A snapshot of
+# that state can be saved as a small JSON file and decoding resumed from
+# it, reading only the samples after DecoderState.sample.
+
+import json
+import os
+
+CHECKPOINT_VERSION = 5
+
+
+class DecoderState:
+    FIELDS = ('sample', 'instruction_start_sample', 'phi1_high', 'ext_word',
+              'irg_word', 'io_word', 'mode')
+
+    def __init__(self):
+        # End of s15 of the last instruction cycle, the next one is searched
+        # from the sample after it. -1 at the start of the capture.
+        self.sample = -1
+        self.instruction_start_sample = 0
+        self.phi1_high = 0
+        self.ext_word = 0
+        self.irg_word = 0
+        self.io_word = 0
+        self.mode = 0
+
+    def snapshot(self):
+        state = DecoderState()
+        state.__dict__.update(self.__dict__)
+        return state
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, values):
+        state = cls()
+        for field in cls.FIELDS:
+            setattr(state, field, int(values[field]))
+        return state
+
+
+def save_checkpoint(path, state, samplerate, **extra):
+    # Written to a temporary file first, so that a crash never leaves a
+    # truncated checkpoint behind.
+    data = {'version': CHECKPOINT_VERSION, 'samplerate': samplerate,
+            'state': state.to_dict()}
+    data.update(extra)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, samplerate):
+    # The saved DecoderState and the whole checkpoint dict, or (None, None)
+    # if there is no usable checkpoint for this samplerate.
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    if data.get('version') != CHECKPOINT_VERSION or data.get('samplerate') != samplerate:
+        return None, None
+    return DecoderState.from_dict(data['state']), data
@@ -0,0 +1,64 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# PHI1 clock recovery.
+#
+# PHI1 is sampled many times per S-state (about 82 samples of PHI1 HI at
+# 5 MHz), but EXT/IRG/IO only need to be read a few times. The decoder
+# locks onto the length of the PHI1 HI phase and reads the lines at
+# STROBES points spread evenly over it, taking the majority of the values
+# read:
+#
+#  - the lock is (re-)measured from s1 of every instruction cycle (s0 may
+#    start inside a PHI1 HI phase, after IDLE fell),
+#  - an S-state whose HI phase differs from the locked length by more
+#    than a quarter (e.g. the slower clock in DISPLAY mode) re-locks to
+#    its length,
+#  - strobe points beyond the end of a short HI phase repeat the last
+#    value read. If the phase ends before the first one (e.g. s0/s1 after
+#    a switch from the slow DISPLAY clock), the lines are read at the
+#    middle of the phase: the value at its start may still be the one of
+#    the S-state before.
+#
+# A locked length of 0 means not locked yet, at the start of a capture.
+
+STROBES = 3
+
+
+def strobe_offsets(high):
+    # Strobe points as samples from the start of an S-state, for a locked
+    # PHI1 HI length of high samples. At least one sample apart.
+    return tuple(max(high * i // (STROBES + 1), i) for i in range(1, STROBES + 1))
+
+
+def strobe_skips(high):
+    # strobe_offsets() as 'skip' counts for wait(), each from the one before
+    offsets = (0,) + strobe_offsets(high)
+    return tuple(b - a for a, b in zip(offsets, offsets[1:]))
+
+
+def drifted(length, high):
+    # Whether a PHI1 HI phase of length samples is off the locked length,
+    # allowing one sample of jitter. Works on NumPy arrays, too.
+    return abs(length - high) > high // 4 + 1
+
+
+def majority(a, b, c):
+    # Bitwise majority vote of three strobes (pin levels or sample bytes)
+    return (a & b) | (a & c) | (b & c)
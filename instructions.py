@@ -0,0 +1,439 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Instruction set of the TI-5x (TMC0501) processor.
+#
+# An instruction word is the 13 bit IRG value read in states s3..s15 of an
+# instruction cycle, s15 being the most significant bit. All 8192 words are
+# decoded once at import time into MNEMONICS/OPCLASSES, so decoding an
+# instruction cycle is a single table lookup.
+#
+# Bus words are kept as integers with the bit of state sN at bit N, the
+# instruction word of an IRG word being irg >> 3.
+
+import string
+import time
+
+class OpClass:
+    UNDECODED, BRANCH, FLAG, MASK, KEY, CONTROL, CARD, PRINTER, LIBRARY, RAM, ALU = range(11)
+
+def get_address(word):
+    # BRA offset: bits 11..2 of the instruction word
+    return (word >> 2) & 0x3FF
+
+
+def get_register(op2):
+    return op2 >> 1
+
+
+def decode_instruction(word):
+    annoText = ""
+
+    firstbit = word >> 12
+    op1 = (word >> 8) & 0xF
+    op2 = (word >> 4) & 0xF
+    op3 = word & 0xF
+
+    if firstbit == 1:
+        lastbit = word & 1
+        address = get_address(word)
+        if lastbit == 0:
+            return "BRA0 offs OR const +" + str(address)
+        else:
+            return "BRA1 offs OR const -"+ str(address)
+
+    #return ""
+
+    if op1 == 0b0000 and op3 == 0b0000:
+        bit = op2
+        annoText = "TST FA(" + str(bit) + ")"
+    if op1 == 0b0000 and op3 == 0b0001:
+        bit = op2
+        annoText = "SET FA(" + str(bit) + ")"
+    if op1 == 0b0000 and op3 == 0b0010:
+        bit = op2
+        annoText = "CLR FA(" + str(bit) + ")"
+    if op1 == 0b0000 and op3 == 0b0011:
+        bit = op2
+        annoText = "INV FA(" + str(bit) + ")"
+    if op1 == 0b0000 and op3 == 0b0100:
+        bit = str(op2)
+        annoText = "XCH FA(" + bit +  "),FB(" + bit + ")"
+
+    if op1 == 0b0000 and op3 == 0b0101 and not (op2 == 0b0001):
+        if op2 == 0b0001:
+            annoText = "SET PREG"
+        else:
+            bit = op2
+            annoText = "SET KR(" + str(bit) + ")"
+
+    if op1 == 0b0000 and op3 == 0b0110:
+        bit = str(op2)
+        annoText = "MOV FA(" + bit +  "),FB(" + bit + ")"
+    if op1 == 0b0000 and op3 == 0b0111:
+        annoText = "MOV FA,R5"
+    if op1 == 0b0000 and op3 == 0b1000:
+        bit = op2
+        annoText = "TST FB(" + str(bit) + ")"
+    if op1 == 0b0000 and op3 == 0b1001:
+        bit = op2
+        annoText = "SET FB(" + str(bit) + ")"
+    if op1 == 0b0000 and op3 == 0b1010:
+        bit = op2
+        annoText = "CLR FB(" + str(bit) + ")"
+    if op1 == 0b0000 and op3 == 0b1011:
+        bit = op2
+        annoText = "INV FB(" + str(bit) + ")"
+    if op1 == 0b0000 and op3 == 0b1100:
+        bit = str(op2)
+        annoText = "CMP FA(" + bit +  "),FB(" + bit + ")"
+    if op1 == 0b0000 and op3 == 0b1101:
+        bit = op2
+        annoText = "CLR KR(" + str(bit) + ")"
+    if op1 == 0b0000 and op3 == 0b1110:
+        bit = str(op2)
+        annoText = "MOV FB(" + bit +  "),FA(" + bit + ")"
+    if op1 == 0b0000 and op3 == 0b1111:
+        annoText = "MOV R5,FB"
+
+    if op1 == 0b0001:
+        annoText = ".ALL"
+    if op1 == 0b0010:
+        annoText = ".DPT"
+    if op1 == 0b0011:
+        annoText = ".DPT1"
+    if op1 == 0b0100:
+        annoText = ".DPTC"
+    if op1 == 0b0101:
+        annoText = ".LLSD1"
+    if op1 == 0b0110:
+        annoText = ".EXP"
+    if op1 == 0b0111:
+        annoText = ".EXP1"
+    if op1 == 0b1000:
+        annoText = "KEY mask"
+    if op1 == 0b1001:
+            annoText = ".MANT"
+    if op1 == 0b1010 and op3 == 0b0000:
+        annoText = "WAIT DIGIT " + str(op2)
+    if op1 == 0b1010 and op3 == 0b0001:
+        annoText = "CLR IDLE"
+    if op1 == 0b1010 and op3 == 0b0010:
+        annoText = "CLR FA"
+    if op1 == 0b1010 and op3 == 0b0011:
+        annoText = "WAIT BUSY"
+    if op1 == 0b1010 and op3 == 0b0100:
+        annoText = "INK KR"
+    if op1 == 0b1010 and op3 == 0b0101:
+        bit = op2
+        annoText = "TST KR(" + str(bit) + ")"
+
+    if op1 == 0b1010 and op2 == 0b0000 and op3 == 0b1100:
+        annoText = "MOV KR,EXT"
+    if op1 == 0b1010 and (op2 & 1) == 0 and op3 == 0b0110:
+        annoText = "MOV R5,FA"
+    if op1 == 0b1010 and (op2 & 1) == 1 and op3 == 0b0110:
+        annoText = "MOV R5,FB"
+    if op1 == 0b1010 and op3 == 0b0111:
+        const = op2
+        annoText = "MOV R5,#" + str(const)
+    if op1 == 0b1010 and op3 == 0b1000 and op2 == 0b0000:
+        annoText = "MOV R5,KR"
+    if op1 == 0b1010 and op3 == 0b1000 and op2 == 0b0001:
+        annoText = "MOV KR,R5"
+
+    # card reader
+    if op1 == 0b1010 and op3 == 0b0010 and op2 == 0b1000:
+        annoText = "IN CRD"
+    if op1 == 0b1010 and op3 == 0b0011 and op2 == 0b1000:
+        annoText = "OUT CRD"
+    if op1 == 0b1010 and op2 == 0b0100 and op3 == 0b1000:
+        annoText = "CRD_OFF"
+    if op1 == 0b1010 and op2 == 0b0101 and op3 == 0b1000:
+        annoText = "CRD_READ"
+
+    # printer
+    if op1 == 0b1010 and op3 == 0b1000 and op2 == 0b0110:
+        annoText = "OUT PRT"
+    if op1 == 0b1010 and op3 == 0b1000 and op2 == 0b0111:
+        annoText = "OUT PRT_FUNC"
+    if op1 == 0b1010 and op2 == 0b1000 and op3 == 0b1000:
+        annoText = "PRT_CLEAR"
+    if op1 == 0b1010 and op3 == 0b1000 and op2 == 0b1001:
+        annoText = "PRT_STEP"
+    if op1 == 0b1010 and op3 == 0b1000 and op2 == 0b1010:
+        annoText = "PRT_PRINT"
+    if op1 == 0b1010 and op3 == 0b1000 and op2 == 0b1011:
+        annoText = "PRT_FEED"
+    if op1 == 0b1010 and op3 == 0b1000 and op2 == 0b1100:
+        annoText = "PRT_WRITE"
+
+    if op1 == 0b1010 and op2 == 0b1111 and op3 == 0b1000:
+        annoText = "RAM_OP"
+    if op1 == 0b1010 and op3 == 0b1001:
+        annoText = "SET IDLE"
+    if op1 == 0b1010 and op3 == 0b1010:
+        annoText = "CLR FB"
+    if op1 == 0b1010 and op3 == 0b1011:
+        annoText = "TST BUSY"
+    if op1 == 0b1010 and op3 == 0b1100:
+        annoText = "MOV KR,EXT"
+    if op1 == 0b1010 and op3 == 0b1101:
+        annoText = "XCH KR,SR"
+    if op1 == 0b1010 and op3 == 0b1110:
+        annoText = "NO-OP"
+    if op1 == 0b1010 and op2 == 0b0000 and op3 == 0b1110: # FETCH
+        annoText = "IN LIB"
+    if op1 == 0b1010 and op2 == 0b0001 and op3 == 0b1110: # "LOAD PC"
+        annoText = "OUT LIB_PC"
+    if op1 == 0b1010 and op2 == 0b0010 and op3 == 0b1110: # "UNLOAD PC"
+        annoText = "IN LIB_PC"
+    if op1 == 0b1010 and op2 == 0b0011 and op3 == 0b1110: # "FETCH HIGH"
+        annoText = "IN LIB_HIGH"
+
+    # register access
+    if op1 == 0b1010 and op3 == 0b1111:
+        register = get_register(op2)
+        if (op2 & 1) == 0:
+            annoText = "REG WRITE(" + str(register) + ")"
+        else:
+            annoText = "REG READ " + str(register) + ")"
+
+    if op1 == 0b1011 :
+        annoText = ".MLSD5"
+    if op1 == 0b1100 :
+        annoText = ".MAEX"
+    if op1 == 0b1101 :
+        annoText = ".MLSD1"
+    if op1 == 0b1110 :
+        annoText = ".MMSD1"
+
+    # ALU operations
+    if op1 == 0b1111 :
+        annoText = handle_alu_instructions(op2, op3)
+
+    #if irgBits2 == "1 1001 1111 100 0":  # C1F8 TRIGGER WORD 58/59 "BRANCH 0N C -1F"
+    #    annoText = "BRANCH 0N C -1F"
+
+    return annoText
+
+def handle_alu_instructions(op2, op3):
+    annoText = ".MAEX1"
+    opPart = ""
+    operandPart = ""
+    destPart = ""
+
+    if op2 == 0b0000:
+        operandPart = "A,#const"
+        if (op3 & 8) == 0:
+            opPart = "ADD"
+        else:
+            opPart = "SUB"
+    if op2 == 0b0001:
+        if (op3 & 8) == 0:
+            opPart = "OR"
+            operandPart = "B,#const"
+        else:
+            opPart = "NEG"
+            operandPart = "B|#const"
+    if op2 == 0b0010:
+        operandPart = "C,#const"
+        if (op3 & 8) == 0:
+            opPart = "ADD"
+        else:
+            opPart = "SUB"
+    if op2 == 0b0001:
+        if (op3 & 8) == 0:
+            opPart = "OR"
+            operandPart = "D,#const"
+        else:
+            opPart = "NEG"
+            operandPart = "D|#const"
+    if op2 == 0b0100:
+        operandPart = "A[,#const]"
+        if (op3 & 8) == 0:
+            opPart = "SHL"
+        else:
+            opPart = "SHR"
+    if op2 == 0b0101:
+        operandPart = "B[,#const]"
+        if (op3 & 8) == 0:
+            opPart = "SHL"
+        else:
+            opPart = "SHR"
+    if op2 == 0b0110:
+        operandPart = "C[,#const]"
+        if (op3 & 8) == 0:
+            opPart = "SHL"
+        else:
+            opPart = "SHR"
+    if op2 == 0b0111:
+        operandPart = "D[,#const]"
+        if (op3 & 8) == 0:
+            opPart = "SHL"
+        else:
+            opPart = "SHR"
+    if op2 == 0b1000:
+        operandPart = "A,B[|#const]"
+        if (op3 & 8) == 0:
+            opPart = "ADD"
+        else:
+            opPart = "SUB"
+    if op2 == 0b1001:
+        operandPart = "C,B[|#const]"
+        if (op3 & 8) == 0:
+            opPart = "ADD"
+        else:
+            opPart = "SUB"
+    if op2 == 0b1010:
+        operandPart = "C,D[|#const]"
+        if (op3 & 8) == 0:
+            opPart = "ADD"
+        else:
+            opPart = "SUB"
+    if op2 == 0b1011:
+        operandPart = "A,D[|#const]"
+        if (op3 & 8) == 0:
+            opPart = "ADD"
+        else:
+            opPart = "SUB"
+    if op2 == 0b1100:
+        operandPart = "A,IO[|#const]"
+        if (op3 & 8) == 0:
+            opPart = "ADD"
+        else:
+            opPart = "SUB"
+    if op2 == 0b1101:
+        opPart = "MOV"
+        if (op3 & 8) == 0:
+            operandPart = "#const"
+        else:
+            operandPart = "-#const"
+    if op2 == 0b1110:
+        operandPart = "C,IO[|#const]"
+        if (op3 & 8) == 0:
+            opPart = "ADD"
+        else:
+            opPart = "SUB"
+    if op2 == 0b1111:
+        operandPart = "R5[|#const]"
+        opPart = "MOV"
+    op3part = op3 & 7
+    if op3part == 0b000: destPart = "A"
+    if op3part == 0b001: destPart = "IO"
+    if op3part == 0b010:
+        destPart = "A,B"
+        opPart = "XCH"
+        operandPart = ""
+    if op3part == 0b011: destPart = "B"
+    if op3part == 0b100: destPart = "C"
+    if op3part == 0b101:
+        destPart = "C,D"
+        opPart = "XCH"
+        operandPart = ""
+    if op3part == 0b110: destPart = "D"
+    if op3part == 0b111:
+        destPart = "A,E"
+        opPart = "XCH"
+        operandPart = ""
+    annoText += " " + opPart + " " + destPart
+    if operandPart != "":
+        annoText += "," + operandPart
+
+    return annoText
+
+def classify_instruction(word, annoText):
+    op1 = (word >> 8) & 0xF
+
+    if annoText == "":
+        return OpClass.UNDECODED
+    if word >> 12 == 1:
+        return OpClass.BRANCH
+    if op1 == 0b0000:
+        return OpClass.FLAG
+    if op1 == 0b1000:
+        return OpClass.KEY
+    if op1 == 0b1111:
+        return OpClass.ALU
+    if op1 != 0b1010:
+        return OpClass.MASK
+    if "CRD" in annoText:
+        return OpClass.CARD
+    if "PRT" in annoText:
+        return OpClass.PRINTER
+    if "LIB" in annoText:
+        return OpClass.LIBRARY
+    if annoText == "RAM_OP" or annoText.startswith("REG "):
+        return OpClass.RAM
+    return OpClass.CONTROL
+
+
+def format_word(word):
+    # 16 bit EXT/IRG word as read from the bus, s0 first, in groups of
+    # four states: "0000.0000.0000.0000"
+    bits = format(word, '016b')[::-1]
+    return bits[0:4] + '.' + bits[4:8] + '.' + bits[8:12] + '.' + bits[12:16]
+
+
+def format_io_word(word):
+    # 64 bit IO bus word as hex digits, the nibble of s15 first
+    return '%016X' % word
+
+
+# Provide custom format type 'H' for hexadecimal output
+# with leading decimal digit (assembler syntax).
+class AsmFormatter(string.Formatter):
+    def format_field(self, value, format_spec):
+        if format_spec.endswith('H'):
+            result = format(value, format_spec[:-1] + 'X')
+            return result if result[0] in string.digits else '0' + result
+        else:
+            return format(value, format_spec)
+
+formatter = AsmFormatter()
+
+
+MNEMONICS = []
+OPCLASSES = bytearray(8192)
+for word in range(8192):
+    annoText = decode_instruction(word)
+    MNEMONICS.append(annoText)
+    OPCLASSES[word] = classify_instruction(word, annoText)
+OPCLASSES = bytes(OPCLASSES)
+
+
+if __name__ == '__main__':
+    # Microbenchmark: decode all 8192 words with the if-chain and with the
+    # lookup table.
+    words = range(8192)
+    rounds = 20
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        chain = [decode_instruction(word) for word in words]
+    t_chain = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        table = [MNEMONICS[word] for word in words]
+    t_table = (time.perf_counter() - start) / rounds
+
+    assert chain == table
+    print('if-chain:     %8.3f ms / 8192 words' % (t_chain * 1000))
+    print('lookup table: %8.3f ms / 8192 words (%.1fx)' % (t_table * 1000, t_chain / t_table))
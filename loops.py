@@ -0,0 +1,186 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Run-length collapsing of repeated instruction loops.
+#
+# In DISPLAY mode the calculator runs the same key scan loop for seconds,
+# itself made of busy waits repeating one instruction. LoopCollapser gets
+# one instruction cycle at a time, with its IRG word, and passes it on
+# either as it is (emit_cycle) or as part of a collapsed loop (emit_loop):
+#
+#  - consecutive cycles with the same IRG word form a run, a run of at
+#    least min_repeats cycles is a loop of its own,
+#  - a sequence of runs (word and length) repeated at least min_repeats
+#    times, with up to max_period runs per iteration, is one loop.
+#
+# Loops are found by their IRG words only; EXT and IO data may differ
+# between the iterations. Cycles are held back until it is known whether
+# they belong to a loop: at most 2 * max_period runs, or min_repeats
+# iterations of a loop.
+
+MAX_PERIOD = 64
+MIN_REPEATS = 3
+
+
+class Run:
+    __slots__ = ('word', 'count', 'first', 'last', 'cycles')
+
+    def __init__(self, word, cycle):
+        self.word = word
+        self.count = 1
+        self.first = cycle
+        self.last = cycle
+        # all cycles, as long as the run is too short to be collapsed
+        self.cycles = [cycle]
+
+    def key(self):
+        return self.word.to_bytes(2, 'little') + self.count.to_bytes(4, 'little')
+
+
+KEY_SIZE = 6
+
+
+class LoopCollapser:
+    def __init__(self, emit_cycle, emit_loop, max_period=MAX_PERIOD,
+                 min_repeats=MIN_REPEATS):
+        # emit_cycle(cycle), emit_loop(first, last, runs, repeats): first
+        # and last cycle of the collapsed loop, runs the (word, count) of
+        # the runs of one iteration
+        self.emit_cycle = emit_cycle
+        self.emit_loop = emit_loop
+        self.max_period = max_period
+        self.min_repeats = max(min_repeats, 2)
+        self.run = None
+        # runs not yet passed on, and their keys
+        self.pending = []
+        self.history = bytearray()
+        # the loop of runs being followed, if any
+        self.pattern = None
+        self.pos = 0
+        self.repeats = 0
+        self.kept = []
+        self.last = None
+        self.partial = []
+
+    def add(self, word, cycle):
+        run = self.run
+        if run is not None and run.word == word:
+            run.count += 1
+            run.last = cycle
+            if run.cycles is not None:
+                run.cycles.append(cycle)
+                if run.count >= self.min_repeats:
+                    run.cycles = None
+            return
+        if run is not None:
+            self._add_run(run)
+        self.run = Run(word, cycle)
+
+    def flush(self):
+        if self.run is not None:
+            self._add_run(self.run)
+            self.run = None
+        partial = self.partial
+        self._end_loop()
+        self.pending.extend(partial)
+        for run in self.pending:
+            self._emit_run(run)
+        self.pending = []
+        self.history = bytearray()
+
+    def _emit_run(self, run):
+        if run.cycles is None:
+            self.emit_loop(run.first, run.last, [(run.word, 1)], run.count)
+        else:
+            for cycle in run.cycles:
+                self.emit_cycle(cycle)
+
+    def _add_run(self, run):
+        if self.pattern is None:
+            self._add_pending(run)
+        elif (run.word, run.count) == self.pattern[self.pos]:
+            self.partial.append(run)
+            self.pos += 1
+            if self.pos == len(self.pattern):
+                self.repeats += 1
+                self.pos = 0
+                if self.repeats <= self.min_repeats:
+                    self.kept.extend(self.partial)
+                self.last = run.last
+                self.partial = []
+        else:
+            partial = self.partial
+            self._end_loop()
+            for r in partial:
+                self._add_pending(r)
+            self._add_pending(run)
+
+    def _add_pending(self, run):
+        self.pending.append(run)
+        self.history += run.key()
+        period = self._period()
+        if period:
+            # the last two blocks of period runs are the same: pass on what
+            # is before them and follow the loop
+            n = len(self.pending) - 2 * period
+            for r in self.pending[:n]:
+                self._emit_run(r)
+            self.kept = self.pending[n:]
+            self.last = self.kept[-1].last
+            self.pattern = [(r.word, r.count) for r in self.kept[:period]]
+            self.pos = 0
+            self.repeats = 2
+            self.partial = []
+            self.pending = []
+            self.history = bytearray()
+        elif len(self.pending) > 2 * self.max_period:
+            self._emit_run(self.pending.pop(0))
+            del self.history[:KEY_SIZE]
+
+    def _period(self):
+        # Smallest period p (in runs), for which the last 2p runs are two
+        # equal blocks, or 0. Candidates are the earlier positions of the
+        # last run.
+        h = self.history
+        n = len(h)
+        key = h[-KEY_SIZE:]
+        lo = max(n - KEY_SIZE - 2 * KEY_SIZE * self.max_period, 0)
+        pos = h.rfind(key, lo, n - 1)
+        while pos >= 0:
+            if pos % KEY_SIZE == 0:
+                size = n - KEY_SIZE - pos
+                if 2 * size > n:
+                    return 0
+                if h[n - 2 * size:n - size] == h[n - size:]:
+                    return size // KEY_SIZE
+            pos = h.rfind(key, lo, pos + KEY_SIZE - 1)
+        return 0
+
+    def _end_loop(self):
+        if self.pattern is None:
+            return
+        if self.repeats >= self.min_repeats:
+            self.emit_loop(self.kept[0].first, self.last, self.pattern, self.repeats)
+        else:
+            for run in self.kept:
+                self._emit_run(run)
+        self.pattern = None
+        self.kept = []
+        self.last = None
+        self.partial = []
@@ -19,7 +19,14 @@
 
 import sigrokdecode as srd
 from functools import reduce
-import string
+import time
+from .instructions import MNEMONICS, OPCLASSES, OpClass, format_io_word, format_word, formatter
+from .records import Record, pack_record
+from .checkpoint import DecoderState, load_checkpoint, save_checkpoint
+from .loops import LoopCollapser
+from .clock import STROBES, drifted, majority, strobe_skips
+from .timing import CycleTiming, DurationTexts
+from .segments import ModeSegments
 
 class SamplerateError(Exception):
     pass
@@ -40,20 +47,103 @@ class Pin:
 class Mode:
     CALCULATE, DISPLAY = range(2)
 
+class Verbosity:
+    INSTRUCTIONS, WORDS, BITS, DEBUG = range(4)
+
+VERBOSITY_VALUES = ('instructions', 'words', 'bits', 'debug')
+
 class AnnoRowPos:
-    STATE, EXTBITS, EXTWORDS, IRGBITS, IRGWORDS, CALC, DISP, TIMING, INSTRUCTION, WARN, ERROR = range(11)
-
-# Provide custom format type 'H' for hexadecimal output
-# with leading decimal digit (assembler syntax).
-class AsmFormatter(string.Formatter):
-    def format_field(self, value, format_spec):
-        if format_spec.endswith('H'):
-            result = format(value, format_spec[:-1] + 'X')
-            return result if result[0] in string.digits else '0' + result
-        else:
-            return format(value, format_spec)
+    STATE, EXTBITS, EXTWORDS, IRGBITS, IRGWORDS, CALC, DISP, TIMING, INSTRUCTION, WARN, ERROR, SUMMARY, IOWORDS = range(13)
 
-formatter = AsmFormatter()
+STATE_NAMES = {value: name for name, value in vars(State).items() if not name.startswith('_')}
+MODE_NAMES = {value: name for name, value in vars(Mode).items() if not name.startswith('_')}
+OPCLASS_NAMES = {value: name for name, value in vars(OpClass).items() if not name.startswith('_')}
+# annotation row of the segments of a mode
+SEGMENT_ROWS = {Mode.CALCULATE: AnnoRowPos.CALC, Mode.DISPLAY: AnnoRowPos.DISP}
+# wait() conditions for a change of any of the lines read at strobe points
+DATA_EDGES = [{pin: 'e'} for pin in (Pin.IDLE, Pin.EXT, Pin.IRG,
+                                      Pin.IO8, Pin.IO4, Pin.IO2, Pin.IO1)]
+
+
+# Counters collected while decoding, reported at the end of the stream.
+class Metrics:
+    def __init__(self):
+        self.state_samples = len(STATE_NAMES) * [0]
+        self.state_seconds = len(STATE_NAMES) * [0.0]
+        self.mode_cycles = len(MODE_NAMES) * [0]
+        self.cycles = 0
+        self.decoded = 0
+        self.undecoded = {}
+        # PHI1 clock: HI phase and period of s1 in samples, summed per mode
+        self.phi1_high = len(MODE_NAMES) * [0]
+        self.phi1_period = len(MODE_NAMES) * [0]
+        self.phi1_cycles = len(MODE_NAMES) * [0]
+        self.relocks = 0
+        # cycle times per mode and instruction class
+        self.timing = CycleTiming(len(MODE_NAMES), len(OPCLASS_NAMES))
+        # runs of cycles in the same mode
+        self.segments = ModeSegments()
+
+    def to_dict(self):
+        return {
+            'state_samples': list(self.state_samples),
+            'state_seconds': list(self.state_seconds),
+            'mode_cycles': list(self.mode_cycles),
+            'cycles': self.cycles,
+            'decoded': self.decoded,
+            'undecoded': {str(word): count for word, count in self.undecoded.items()},
+            'phi1_high': list(self.phi1_high),
+            'phi1_period': list(self.phi1_period),
+            'phi1_cycles': list(self.phi1_cycles),
+            'relocks': self.relocks,
+            'timing': self.timing.to_dict(),
+            'segments': self.segments.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        metrics = cls()
+        metrics.__dict__.update(values)
+        metrics.undecoded = {int(word): count for word, count in values['undecoded'].items()}
+        metrics.timing = CycleTiming.from_dict(values['timing'])
+        metrics.segments = ModeSegments.from_dict(values['segments'])
+        return metrics
+
+    def hit_rate(self):
+        return self.decoded / self.cycles if self.cycles else 0.0
+
+    def summary(self, text):
+        # text: DurationTexts of the decoder
+        samplerate = text.samplerate
+        lines = [
+            'Instruction cycles: %d (%s)' % (self.cycles, ', '.join(
+                '%s %d' % (MODE_NAMES[mode], count)
+                for mode, count in enumerate(self.mode_cycles))),
+            'Decoded: %d, hit rate %.2f%%' % (self.decoded, 100 * self.hit_rate()),
+            'Samples per state: ' + ', '.join(
+                '%s %d' % (STATE_NAMES[state], count)
+                for state, count in enumerate(self.state_samples)),
+            'Time per state: ' + ', '.join(
+                '%s %.3f s' % (STATE_NAMES[state], seconds)
+                for state, seconds in enumerate(self.state_seconds)),
+            'PHI1: ' + ', '.join(
+                '%s period %s, duty cycle %.0f%%' % (
+                    MODE_NAMES[mode],
+                    normalize_time(self.phi1_period[mode] / cycles / samplerate),
+                    100 * self.phi1_high[mode] / self.phi1_period[mode])
+                for mode, cycles in enumerate(self.phi1_cycles) if cycles)
+            + ', %d re-locks' % self.relocks,
+            'Mode segments: %d (%s)' % (len(self.segments), ', '.join(
+                '%s %d' % (MODE_NAMES[mode], count)
+                for mode, count in enumerate(self.segments.counts(len(MODE_NAMES))))),
+        ]
+        lines += self.timing.report(text, MODE_NAMES, OPCLASS_NAMES)
+        if self.undecoded:
+            lines.append('Undecoded: ' + ', '.join(
+                formatter.format('{:04H} x{}', word, count)
+                for word, count in sorted(self.undecoded.items(),
+                                          key=lambda item: -item[1])))
+        return lines
 
 
 def normalize_time(t):
@@ -78,59 +168,11 @@ def normalize_time(t):
         return '%f' % t
 
 
-def get_nibble(d):
-    #print(d)
-    result = 0
-    if d[0]=="1":
-        result += 8
-    if d[1]=="1":
-        result += 4
-    if d[2]=="1":
-        result += 2
-    if d[3]=="1":
-        result += 1
-    #print("Nibble: " + d + " -> " + str(result))
-    return result
-
-
-def get_address(d):
-    #print(d)
-    result = 0
-    if d[0]=="1":
-        result += 512
-    if d[1]=="1":
-        result += 256
-    if d[2]=="1":
-        result += 128
-    if d[3]=="1":
-        result += 64
-    if d[4]=="1":
-        result += 32
-    if d[5]=="1":
-        result += 16
-    if d[6]=="1":
-        result += 8
-    if d[7]=="1":
-        result += 4
-    if d[8]=="1":
-        result += 2
-    if d[9]=="1":
-        result += 1
-    #print("Address: " + d + " -> " + str(result))
-    return result
-
-
-def get_register(d):
-    #print(d)
-    result = 0
-    if d[0]=="1":
-        result += 4
-    if d[1]=="1":
-        result += 2
-    if d[2]=="1":
-        result += 1
-    #print("Register: " + d + " -> " + str(result))
-    return result
+def format_duration(t):
+    for unit, scale in (('s', 1.0), ('ms', 1e-3), ('μs', 1e-6)):
+        if abs(t) >= scale:
+            return '%.3f %s' % (t / scale, unit)
+    return '%.3f ns' % (t * 1e9)
 
 
 class Decoder(srd.Decoder):
@@ -141,7 +183,7 @@ class Decoder(srd.Decoder):
     desc     = 'Texas Instruments TI-5x pocket calculator system bus decoding.'
     license  = 'gplv3+'
     inputs   = ['logic']
-    outputs  = []
+    outputs  = ['ti5x']
     tags     = ['Retro computing']
     channels = (
         {'id': 'idle', 'name': 'IDLE', 'desc': 'IDLE'},
@@ -154,6 +196,17 @@ class Decoder(srd.Decoder):
         {'id': 't1', 'name': 'PHI1', 'desc': 'clock PHI 1'},
     )
     optional_channels = ()
+    options = (
+        {'id': 'verbosity', 'desc': 'Annotations',
+            'default': 'instructions', 'values': VERBOSITY_VALUES},
+        {'id': 'checkpoint', 'desc': 'Checkpoint file', 'default': ''},
+        {'id': 'checkpoint_cycles', 'desc': 'Save checkpoint every N cycles',
+            'default': 100000},
+        {'id': 'resume', 'desc': 'Resume from checkpoint', 'default': 'no',
+            'values': ('no', 'yes')},
+        {'id': 'collapse', 'desc': 'Collapse repeated loops', 'default': 'no',
+            'values': ('no', 'yes')},
+    )
     annotations = (
         ('s0', 'Start of instruction cycle'),
         ('extbit', 'EXT line data bits'),
@@ -166,6 +219,12 @@ class Decoder(srd.Decoder):
         ('instruction', 'Instruction'),
         ('warning', 'Warning'),
         ('error', 'Error'),
+        ('summary', 'Summary'),
+        ('ioword', 'IO bus data word'),
+    )
+
+    binary = (
+        ('trace', 'Instruction trace (see records.py)'),
     )
 
     annotation_rows = (
@@ -174,23 +233,25 @@ class Decoder(srd.Decoder):
         ('extwords', 'EXTW', (2,)),
         ('irgbits', 'IRG', (3,)),
         ('irgwords', 'IRGW', (4,)),
+        ('iowords', 'IO', (12,)),
         ('calc', 'Timing Calculate', (5,)),
         ('disp', 'Timing Display', (6,)),
         ('timings', 'Timings', (7,)),
         ('instructions', 'Instructions', (8,)),
         ('warnings', 'Warnings', (9,)),
         ('errors', 'Errors', (10,)),
+        ('summary', 'Summary', (11,)),
     )
 
     def __init__(self):
         self.state = State.INIT
-        self.last_idle = 0
-        self.last_phi1 = 0
         self.last_state = 0
-        self.instruction_start_sample = 0
         self.state_start_sample = 0
         self.sx_samplenum = 0
-        self.mode = Mode.CALCULATE
+        self.cycle = DecoderState()
+        self.last_checkpoint = None
+        self.collapser = None
+        self.metrics = Metrics()
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
@@ -203,498 +264,333 @@ class Decoder(srd.Decoder):
 
     def start(self):
         self.out_ann    = self.register(srd.OUTPUT_ANN)
+        self.verbosity = VERBOSITY_VALUES.index(self.options['verbosity'])
+        self.checkpoint_path = self.options['checkpoint']
+        self.checkpoint_cycles = max(int(self.options['checkpoint_cycles']), 1)
+        self.collapse = self.options['collapse'] == 'yes'
+        self.out_python = self.register(srd.OUTPUT_PYTHON)
+        self.out_binary = self.register(srd.OUTPUT_BINARY)
+        self.out_cycles = self.register(srd.OUTPUT_META,
+                meta=(int, 'Instruction cycles', 'Number of instruction cycles'))
+        self.out_hit_rate = self.register(srd.OUTPUT_META,
+                meta=(float, 'Decode hit rate', 'Share of instruction words decoded'))
 
     def put_text(self, ss, ann_idx, ann_text):
         self.put(ss, self.samplenum, self.out_ann, [ann_idx, [ann_text]])
 
+    def put_timing(self, ss, es):
+        # cycle time of the instruction cycle from ss to es
+        self.put(ss, es, self.out_ann,
+                 [AnnoRowPos.TIMING, [self.time_text(es - ss)]])
+
+    def put_words(self, record):
+        # EXT line value annotation
+        self.put(record.ss, record.es, self.out_ann,
+                 [AnnoRowPos.EXTWORDS, [format_word(record.ext)]])
+        # IRG line value annotation
+        self.put(record.ss, record.es, self.out_ann,
+                 [AnnoRowPos.IRGWORDS, [format_word(record.irg)]])
+        # IO bus word annotation
+        self.put(record.ss, record.es, self.out_ann,
+                 [AnnoRowPos.IOWORDS, [format_io_word(record.io)]])
+
+    def put_cycle(self, cycle):
+        # Annotations of one instruction cycle held back by the
+        # LoopCollapser: (start of the previous cycle, Record)
+        previous_start, record = cycle
+        self.put_timing(previous_start, record.ss)
+        if self.verbosity >= Verbosity.WORDS:
+            self.put_words(record)
+        annoText = self.get_instruction(record.irg >> 3)
+        if annoText != "":
+            self.put(record.ss, record.es, self.out_ann,
+                     [AnnoRowPos.INSTRUCTION, [annoText]])
+
+    def put_loop(self, first, last, runs, repeats):
+        # One annotation for repeats iterations of a loop, from the start
+        # of the first to the end of the last cycle. runs: (IRG word,
+        # count) of the instruction runs of one iteration.
+        previous_start, record = first
+        ss, es = record.ss, last[1].es
+        cycles = sum(count for _, count in runs) * repeats
+        # cycle time of the cycle before the loop, the one of the last cycle
+        # of the loop goes with the cycle after it
+        self.put_timing(previous_start, ss)
+        if cycles > 1:
+            average = (last[1].ss - ss) / (cycles - 1) / self.samplerate
+            self.put(ss, last[1].ss, self.out_ann, [AnnoRowPos.TIMING,
+                     ['avg ' + normalize_time(average), normalize_time(average)]])
+        names = []
+        for word, count in runs[:4]:
+            name = self.get_instruction(word >> 3) or '?'
+            names.append(name if count == 1 else '%s x%d' % (name, count))
+        if len(runs) > 4:
+            names.append('...')
+        self.put(ss, es, self.out_ann, [AnnoRowPos.INSTRUCTION, [
+            '%d x loop of %d: %s' % (repeats, cycles // repeats, ', '.join(names)),
+            '%d x %d' % (repeats, cycles // repeats)]])
+
+    def put_segment(self, segment):
+        # one annotation per run of cycles in the same mode, on the row of
+        # the mode
+        ss, es, mode, cycles = segment
+        length = format_duration((es - ss) / self.samplerate)
+        self.put(ss, es, self.out_ann, [SEGMENT_ROWS[mode], [
+            '%s: %d cycles, %s' % (MODE_NAMES[mode], cycles, length),
+            MODE_NAMES[mode], MODE_NAMES[mode][0]]])
+
+    def put_record(self, record):
+        # one record per instruction cycle for stacked decoders and exporters
+        self.put(record.ss, record.es, self.out_python, ['CYCLE', record])
+        self.put(record.ss, record.es, self.out_binary, [0, pack_record(record)])
+
+    def put_summary(self):
+        m = self.metrics
+        self.put(0, self.samplenum, self.out_cycles, m.cycles)
+        self.put(0, self.samplenum, self.out_hit_rate, m.hit_rate())
+        for line in m.summary(self.time_text):
+            self.put(0, self.samplenum, self.out_ann, [AnnoRowPos.SUMMARY, [line]])
+
+    def restore_checkpoint(self):
+        state, data = load_checkpoint(self.checkpoint_path, self.samplerate)
+        if state is None:
+            self.put(0, 0, self.out_ann, [AnnoRowPos.WARN,
+                     ['No checkpoint to resume from', 'No checkpoint']])
+            return
+        self.cycle = state
+        # checkpoints of tools.offline carry no metrics, the summary then
+        # only covers the cycles after the checkpoint
+        if 'metrics' in data:
+            self.metrics = Metrics.from_dict(data['metrics'])
+
+    def end_of_cycle(self):
+        # Instruction cycle boundary: the end of s15.
+        self.cycle.sample = self.samplenum
+        if self.checkpoint_path:
+            self.last_checkpoint = (self.cycle.snapshot(), self.metrics.to_dict())
+            if self.metrics.cycles % self.checkpoint_cycles == 0:
+                self.save_checkpoint()
+
+    def save_checkpoint(self):
+        if self.last_checkpoint:
+            state, metrics = self.last_checkpoint
+            save_checkpoint(self.checkpoint_path, state, self.samplerate,
+                            metrics=metrics)
+
+    def set_state(self, state, debug):
+        # account samples and wall time to the state being left
+        now = time.perf_counter()
+        self.metrics.state_samples[self.state] += self.samplenum - self.state_start_sample
+        self.metrics.state_seconds[self.state] += now - self.state_start_time
+        # forward state machine
+        self.state = state
+        self.state_start_sample = self.samplenum
+        self.state_start_time = now
+        if debug>0:
+            self.put(self.samplenum, self.samplenum, self.out_ann,
+                     [AnnoRowPos.WARN, [str(state)]])
+
     def decode(self):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
 
-        statenum = 0
         self.state = State.INIT
+        self.state_start_sample = 0
+        self.state_start_time = time.perf_counter()
+        self.cycle = DecoderState()
+        self.last_checkpoint = None
+        self.metrics = Metrics()
+        self.time_text = DurationTexts(self.samplerate, normalize_time)
+        if self.checkpoint_path and self.options['resume'] == 'yes':
+            self.restore_checkpoint()
+        self.collapser = None
+        if self.collapse:
+            self.collapser = LoopCollapser(self.put_cycle, self.put_loop)
+        try:
+            self.decode_cycles()
+        except EOFError:
+            # end of stream, account the last state and report
+            self.set_state(State.INIT, 0)
+            if self.collapser:
+                self.collapser.flush()
+            if self.metrics.segments.last():
+                self.put_segment(self.metrics.segments.last())
+            self.save_checkpoint()
+            self.put_summary()
+
+    def decode_cycles(self):
+        # State carried from one instruction cycle to the next, see
+        # checkpoint.py. EXT/IRG words hold bit N read in state sN,
+        # phi1_high is the PHI1 HI length locked onto, see clock.py.
+        cs = self.cycle
+        m = self.metrics
+        # wait() skips to the strobe points of the locked clock
+        skips = strobe_skips(cs.phi1_high)
+        # EXT/IRG bits and IO8..IO1 nibble of the current S-state
         valExt = 0
         valIRG = 0
-
-        debug = 1 # 0 or 1
-        decoded = 0
-        total = 0
-        total_instructions = 0
-
-        s_ext_values = 16 * [0]
-        s_irg_values = 16 * [0]
-
-        # initialize state machine
-        next_state = State.INIT
-
+        valIO = 0
+
+        # Annotations below the chosen verbosity are not built at all:
+        # 'instructions' puts instruction and timing of every cycle,
+        # 'words' adds EXT/IRG words and s0, 'bits' adds every S-state
+        # with its bits and 'debug' the transitions of the state machine.
+        show_words = self.verbosity >= Verbosity.WORDS
+        show_bits = self.verbosity >= Verbosity.BITS
+        debug = 1 if self.verbosity >= Verbosity.DEBUG else 0
+        # With option 'collapse', the annotations of a cycle are passed to
+        # the LoopCollapser instead, which puts them once it knows whether
+        # the cycle is part of a repeated loop.
+        collapser = self.collapser
+
+        if cs.sample >= 0:
+            # resumed: continue right after the last instruction cycle
+            self.wait({'skip': cs.sample + 1})
+            self.state_start_sample = self.samplenum
+        elif show_bits:
+            self.put(0, 0, self.out_ann, [AnnoRowPos.STATE, ['INIT']])
+
+        # The state machine only wakes up on the samples where something
+        # happens (IDLE low, PHI1 edges, strobe points), so the number of
+        # iterations is proportional to the number of S-states read, not
+        # to the number of samples.
         while True:
-            pins = self.wait()
-            idle = pins[Pin.IDLE]
-            phi1 = pins[Pin.PHI1]
-            ext = pins[Pin.EXT]
-            irg = pins[Pin.IRG]
-
-            total += 1
-
-            if next_state != self.state:
-                # A new state was reached
-                self.state_start_sample = self.samplenum
-                # forward state machine
-                self.state = next_state
-                if debug>0:
-                    #name = next(name for name, value in vars(State).items() if value == self.state)
-                    name = str(self.state)
-                    self.put(self.samplenum, self.samplenum, self.out_ann,
-                             [AnnoRowPos.WARN, [name]])
-
-            if self.state == State.INIT:
-                # next state will wait for IDLE become LO
-                next_state = State.WAIT_FOR_IDLE_LO
-                # initialize last_* values
-                self.last_idle = idle
-                self.last_phi1 = phi1
-                self.put_text(self.samplenum, AnnoRowPos.STATE,
-                              'INIT')
-
-            if self.state == State.WAIT_FOR_IDLE_LO:
-                # wait for IDLE become LO
-                # falling edge of IDLE ?
-                # Test change: if idle became LO during last phi1=1, we would miss this by checking for edge.
-                # So I check for IDLE==LO only, without edge check.
-                # OLD: if idle == 0: and self.last_idle == 1:
-                if idle == 0:
-                    next_state = State.WAIT_FOR_PHI_HI
-
-                    # calculate cycle time
-                    cycle_duration = (self.samplenum - self.instruction_start_sample) / self.samplerate
-                    self.put(self.instruction_start_sample, self.samplenum, self.out_ann,
-                             [AnnoRowPos.TIMING, [normalize_time(cycle_duration)]])
-
-                    # keep starting sample for later use
-                    self.instruction_start_sample = self.samplenum
-                    self.state_start_sample = self.samplenum
-                    statenum = 0
-                    total_instructions += 1
-
-            if self.state == State.WAIT_FOR_PHI_HI:
-                # read s0 until phi1 is true
-                if phi1 == 1:
-                    next_state = State.SX_START
-                    # initialize bit value for sx state
-                    valExt = ext
-                    valIRG = irg
-
-            if self.state == State.SX_START:
-                # start location of sx state
-                self.sx_samplenum = self.state_start_sample
+            # Wait for IDLE to become LO. A level condition is used instead
+            # of a falling edge, as IDLE may already have fallen during the
+            # PHI1 high phase of the last S-state.
+            self.set_state(State.WAIT_FOR_IDLE_LO, debug)
+            self.wait({Pin.IDLE: 'l'})
+
+            # keep starting sample for later use
+            previous_start = cs.instruction_start_sample
+            cs.instruction_start_sample = self.samplenum
+            if not collapser:
+                self.put_timing(previous_start, cs.instruction_start_sample)
+
+            for statenum in range(16):
+                # read s0..s15, each starts with PHI1 becoming HI
+                self.set_state(State.WAIT_FOR_PHI_HI, debug)
+                first = self.wait({Pin.PHI1: 'h'})
 
-                if debug>0 or statenum==0:
+                # start location of sx state
+                self.set_state(State.SX_START, debug)
+                if statenum == 2:
+                    # s1 is a whole PHI1 period, account it to the mode
+                    m.phi1_high[cs.mode] += cs.phi1_high
+                    m.phi1_period[cs.mode] += self.samplenum - self.sx_samplenum
+                    m.phi1_cycles[cs.mode] += 1
+                self.sx_samplenum = self.samplenum
+                if show_bits or (show_words and statenum==0):
                     self.put_text(self.sx_samplenum, AnnoRowPos.STATE,
                                   's' + str(statenum))
-                next_state = State.SX
 
-            if self.state == State.SX:
-                if phi1 == 1:
-                    valExt += ext
-                    valIRG += irg
+                # Strobe EXT/IRG/IO at the strobe points up to the end of
+                # the PHI1 high phase. Up to the first strobe point, the
+                # changes of the lines are kept as well: if the phase ends
+                # before it (a clock locked onto a longer phase, as in s0/s1
+                # of the first CALCULATE cycle after DISPLAY mode), the
+                # lines are read at the middle of the phase instead.
+                strobes = []
+                changes = []
+                for skip in skips:
+                    if strobes:
+                        pins = self.wait([{Pin.PHI1: 'l'}, {'skip': skip}])
+                    else:
+                        point = self.samplenum + skip
+                        pins = self.wait([{Pin.PHI1: 'l'}, {'skip': skip}] + DATA_EDGES)
+                        while not (self.matched[0] or self.matched[1]):
+                            changes.append((self.samplenum, pins))
+                            pins = self.wait([{Pin.PHI1: 'l'},
+                                              {'skip': point - self.samplenum}] + DATA_EDGES)
+                    if self.matched[0]:
+                        break
+                    if not strobes:
+                        self.set_state(State.SX, debug)
+                    strobes.append(pins)
                 else:
-                    next_state = State.SX_END
+                    self.wait({Pin.PHI1: 'l'})
+                if not strobes:
+                    middle = self.sx_samplenum + (self.samplenum - self.sx_samplenum) // 2
+                    pins = first
+                    for samplenum, changed in changes:
+                        if samplenum > middle:
+                            break
+                        pins = changed
+                    strobes.append(pins)
+                while len(strobes) < STROBES:
+                    strobes.append(strobes[-1])
+                a, b, c = strobes
+                valExt = majority(a[Pin.EXT], b[Pin.EXT], c[Pin.EXT])
+                valIRG = majority(a[Pin.IRG], b[Pin.IRG], c[Pin.IRG])
+                valIO = ((majority(a[Pin.IO8], b[Pin.IO8], c[Pin.IO8]) << 3)
+                         | (majority(a[Pin.IO4], b[Pin.IO4], c[Pin.IO4]) << 2)
+                         | (majority(a[Pin.IO2], b[Pin.IO2], c[Pin.IO2]) << 1)
+                         | majority(a[Pin.IO1], b[Pin.IO1], c[Pin.IO1]))
+                idle = majority(a[Pin.IDLE], b[Pin.IDLE], c[Pin.IDLE])
+
+                # Clock recovery: lock onto the PHI1 high phase of s1,
+                # re-lock if another S-state drifts off it.
+                length = self.samplenum - self.sx_samplenum
+                if statenum and drifted(length, cs.phi1_high):
+                    # the first lock of a capture is no re-lock
+                    if cs.phi1_high:
+                        m.relocks += 1
+                        if debug:
+                            self.put_text(self.sx_samplenum, AnnoRowPos.WARN,
+                                          'PHI1 re-lock: %d samples' % length)
+                    cs.phi1_high = length
+                    skips = strobe_skips(length)
+                elif statenum == 1 and length != cs.phi1_high:
+                    cs.phi1_high = length
+                    skips = strobe_skips(length)
 
                 if statenum == 1:
-                    if idle == 1:
-                        self.mode = Mode.CALCULATE
-                        #self.put(self.samplenum, self.samplenum+4, self.out_ann,
-                        #         [AnnoRowPos.CALC, ['CALCULATE']])
-                    else:
-                        self.mode = Mode.DISPLAY
-                        #self.put(self.samplenum, self.samplenum+4, self.out_ann,
-                        #         [AnnoRowPos.DISP, ['DISPLAY']])
-
-            if self.state == State.SX_END:
-                self.put(self.sx_samplenum, self.samplenum, self.out_ann,
-                         [AnnoRowPos.EXTBITS, [str(valExt)]])
-                self.put(self.sx_samplenum, self.samplenum, self.out_ann,
-                         [AnnoRowPos.IRGBITS, [str(valIRG)]])
-                s_ext_values[statenum] = valExt
-                s_irg_values[statenum] = valIRG
-
-                if statenum < 15:
-                    # wait for next sx state
-                    next_state = State.WAIT_FOR_PHI_HI
-                    statenum += 1
-                else:
-                    # all states of this instruction cycle have been read, start over
-                    statenum = 0
-                    next_state = State.WAIT_FOR_IDLE_LO
-
-                if statenum == 15:
-                    # Add last bit value
-                    extBits = ""
-                    i = 0
-                    for x in s_ext_values:
-                        if x>1:
-                            x=1
-                        extBits += str(x)
-                        i+=1
-                        if i>0 and i<16 and i % 4 == 0:
-                            extBits += "."
-
-                    irgBits = ""
-                    i = 0
-                    for x in s_irg_values:
-                        if x>1:
-                            x=1
-                        irgBits += str(x)
-                        i+=1
-                        if i>0 and i<16 and i % 4 == 0:
-                            irgBits += "."
-
-                    # EXT line value annotation
-                    self.put(self.instruction_start_sample, self.samplenum, self.out_ann,
-                             [AnnoRowPos.EXTWORDS, [extBits]])
-                    # IRG line value annotation
-                    self.put(self.instruction_start_sample, self.samplenum, self.out_ann,
-                             [AnnoRowPos.IRGWORDS, [irgBits]])
-
-                    instructionPart = irgBits[3:]
-                    reversed = instructionPart[::-1]
-
-                    annoText = self.get_instruction(reversed)
+                    # annotated per segment, see put_segment()
+                    cs.mode = Mode.CALCULATE if idle == 1 else Mode.DISPLAY
+
+                self.set_state(State.SX_END, debug)
+                if show_bits:
+                    self.put(self.sx_samplenum, self.samplenum, self.out_ann,
+                             [AnnoRowPos.EXTBITS, [str(valExt)]])
+                    self.put(self.sx_samplenum, self.samplenum, self.out_ann,
+                             [AnnoRowPos.IRGBITS, [str(valIRG)]])
+                mask = 1 << statenum
+                cs.ext_word = (cs.ext_word & ~mask) | (valExt << statenum)
+                cs.irg_word = (cs.irg_word & ~mask) | (valIRG << statenum)
+                shift = 4 * statenum
+                cs.io_word = (cs.io_word & ~(0xF << shift)) | (valIO << shift)
+
+                if statenum == 14:
+                    # Words are emitted once s14 has been read; bit 15 still
+                    # holds s15 of the previous instruction cycle.
+                    instruction = cs.irg_word >> 3
+                    record = Record(cs.instruction_start_sample, self.samplenum,
+                                    cs.irg_word, cs.ext_word, cs.io_word, cs.mode,
+                                    OPCLASSES[instruction])
+
+                    if collapser:
+                        collapser.add(cs.irg_word, (previous_start, record))
+                    elif show_words:
+                        self.put_words(record)
+
+                    annoText = self.get_instruction(instruction)
+                    m.cycles += 1
+                    m.mode_cycles[cs.mode] += 1
+                    m.timing.cycle(record.ss, record.mode, record.opclass)
+                    segment = m.segments.add(record.ss, record.es, record.mode)
+                    if segment:
+                        self.put_segment(segment)
                     if annoText != "":
-                        decoded += 1
-                        #if (decoded % 100 == 0):
-                        #    print("Decoded: " + str(decoded) + " from total: " + str(total_instructions))
-                        self.put(self.instruction_start_sample, self.samplenum, self.out_ann,
-                                 [AnnoRowPos.INSTRUCTION, [annoText]])
+                        m.decoded += 1
+                        if not collapser:
+                            self.put(cs.instruction_start_sample, self.samplenum, self.out_ann,
+                                     [AnnoRowPos.INSTRUCTION, [annoText]])
                     else:
-                        print("Undecoded instruction: " + reversed )
-                    #annoText = self.get_instruction(irgBits[::-1])
-                    #if annoText != "":
-                    #    self.put(self.instruction_start_sample, self.samplenum, self.out_ann,
-                    #             [AnnoRowPos.INSTRUCTION, [annoText + "(R)"]])
-
-            # update last_* values
-            self.last_idle = idle
-            self.last_phi1 = phi1
-
-
-    def get_instruction(self, irgBits):
-        irgBits2 = irgBits.replace('.', '')
-        #print (irgBits2)
-        annoText = ""
-
-        firstbit=irgBits2[0]
-        op1 = irgBits2[1:5]
-        op2 = irgBits2[5:9]
-        op3 = irgBits2[9:13]
-        #print( firstbit + "." + op1 + "." + op2 + "." + op3 )
-
-        if firstbit=="1":
-            lastbit = irgBits2[12]
-            address = get_address(irgBits2[1:12])
-            if lastbit == "0":
-                return "BRA0 offs OR const +" + str(address)
-            else:
-                return "BRA1 offs OR const -"+ str(address)
-
-        #return ""
-
-        if op1 == "0000" and op3 == "0000":
-            bit = get_nibble(op2)
-            annoText = "TST FA(" + str(bit) + ")"
-        if op1 == "0000" and op3 == "0001":
-            bit = get_nibble(op2)
-            annoText = "SET FA(" + str(bit) + ")"
-        if op1 == "0000" and op3 == "0010":
-            bit = get_nibble(op2)
-            annoText = "CLR FA(" + str(bit) + ")"
-        if op1 == "0000" and op3 == "0011":
-            bit = get_nibble(op2)
-            annoText = "INV FA(" + str(bit) + ")"
-        if op1 == "0000" and op3 == "0100":
-            bit = str(get_nibble(op2))
-            annoText = "XCH FA(" + bit +  "),FB(" + bit + ")"
-
-        if op1 == "0000" and op3 == "0101" and not (op2 == "0001"):
-            if op2 == "0001":
-                annoText = "SET PREG"
-            else:
-                bit = get_nibble(op2)
-                annoText = "SET KR(" + str(bit) + ")"
-
-        if op1 == "0000" and op3 == "0110":
-            bit = str(get_nibble(op2))
-            annoText = "MOV FA(" + bit +  "),FB(" + bit + ")"
-        if op1 == "0000" and op3 == "0111":
-            annoText = "MOV FA,R5"
-        if op1 == "0000" and op3 == "1000":
-            bit = get_nibble(op2)
-            annoText = "TST FB(" + str(bit) + ")"
-        if op1 == "0000" and op3 == "1001":
-            bit = get_nibble(op2)
-            annoText = "SET FB(" + str(bit) + ")"
-        if op1 == "0000" and op3 == "1010":
-            bit = get_nibble(op2)
-            annoText = "CLR FB(" + str(bit) + ")"
-        if op1 == "0000" and op3 == "1011":
-            bit = get_nibble(op2)
-            annoText = "INV FB(" + str(bit) + ")"
-        if op1 == "0000" and op3 == "1100":
-            bit = str(get_nibble(op2))
-            annoText = "CMP FA(" + bit +  "),FB(" + bit + ")"
-        if op1 == "0000" and op3 == "1101":
-            bit = get_nibble(op2)
-            annoText = "CLR KR(" + str(bit) + ")"
-        if op1 == "0000" and op3 == "1110":
-            bit = str(get_nibble(op2))
-            annoText = "MOV FB(" + bit +  "),FA(" + bit + ")"
-        if op1 == "0000" and op3 == "1111":
-            annoText = "MOV R5,FB"
-
-        if op1 == "0001":
-            annoText = ".ALL"
-        if op1 == "0010":
-            annoText = ".DPT"
-        if op1 == "0011":
-            annoText = ".DPT1"
-        if op1 == "0100":
-            annoText = ".DPTC"
-        if op1 == "0101":
-            annoText = ".LLSD1"
-        if op1 == "0110":
-            annoText = ".EXP"
-        if op1 == "0111":
-            annoText = ".EXP1"
-        if op1 == "1000":
-            annoText = "KEY mask"
-        if op1 == "1001":
-                annoText = ".MANT"
-        if op1 == "1010" and op3 == "0000":
-            annoText = "WAIT DIGIT " + str(get_nibble(op2))
-        if op1 == "1010" and op3 == "0001":
-            annoText = "CLR IDLE"
-        if op1 == "1010" and op3 == "0010":
-            annoText = "CLR FA"
-        if op1 == "1010" and op3 == "0011":
-            annoText = "WAIT BUSY"
-        if op1 == "1010" and op3 == "0100":
-            annoText = "INK KR"
-        if op1 == "1010" and op3 == "0101":
-            bit = get_nibble(op2)
-            annoText = "TST KR(" + str(bit) + ")"
-
-        if op1 == "1010" and op2 == "0000" and op3 == "1100":
-            annoText = "MOV KR,EXT"
-        if op1 == "1010" and op2[3] == "0" and op3 == "0110":
-            annoText = "MOV R5,FA"
-        if op1 == "1010" and op2[3] == "1" and op3 == "0110":
-            annoText = "MOV R5,FB"
-        if op1 == "1010" and op3 == "0111":
-            const = get_nibble(op2)
-            annoText = "MOV R5,#" + str(const)
-        if op1 == "1010" and op3 == "1000" and op2 == "0000":
-            annoText = "MOV R5,KR"
-        if op1 == "1010" and op3 == "1000" and op2 == "0001":
-            annoText = "MOV KR,R5"
-
-        # card reader
-        if op1 == "1010" and op3 == "0010" and op2 == "1000":
-            annoText = "IN CRD"
-        if op1 == "1010" and op3 == "0011" and op2 == "1000":
-            annoText = "OUT CRD"
-        if op1 == "1010" and op2 == "0100" and op3 == "1000":
-            annoText = "CRD_OFF"
-        if op1 == "1010" and op2 == "0101" and op3 == "1000":
-            annoText = "CRD_READ"
-
-        # printer
-        if op1 == "1010" and op3 == "1000" and op2 == "0110":
-            annoText = "OUT PRT"
-        if op1 == "1010" and op3 == "1000" and op2 == "0111":
-            annoText = "OUT PRT_FUNC"
-        if op1 == "1010" and op2 == "1000" and op3 == "1000":
-            annoText = "PRT_CLEAR"
-        if op1 == "1010" and op3 == "1000" and op2 == "1001":
-            annoText = "PRT_STEP"
-        if op1 == "1010" and op3 == "1000" and op2 == "1010":
-            annoText = "PRT_PRINT"
-        if op1 == "1010" and op3 == "1000" and op2 == "1011":
-            annoText = "PRT_FEED"
-        if op1 == "1010" and op3 == "1000" and op2 == "1100":
-            annoText = "PRT_WRITE"
-
-        if op1 == "1010" and op2 == "1111" and op3 == "1000":
-            annoText = "RAM_OP"
-        if op1 == "1010" and op3 == "1001":
-            annoText = "SET IDLE"
-        if op1 == "1010" and op3 == "1010":
-            annoText = "CLR FB"
-        if op1 == "1010" and op3 == "1011":
-            annoText = "TST BUSY"
-        if op1 == "1010" and op3 == "1100":
-            annoText = "MOV KR,EXT"
-        if op1 == "1010" and op3 == "1101":
-            annoText = "XCH KR,SR"
-        if op1 == "1010" and op3 == "1110":
-            annoText = "NO-OP"
-        if op1 == "1010" and op2 == "0000" and op3 == "1110": # FETCH
-            annoText = "IN LIB"
-        if op1 == "1010" and op2 == "0001" and op3 == "1110": # "LOAD PC"
-            annoText = "OUT LIB_PC"
-        if op1 == "1010" and op2 == "0010" and op3 == "1110": # "UNLOAD PC"
-            annoText = "IN LIB_PC"
-        if op1 == "1010" and op2 == "0011" and op3 == "1110": # "FETCH HIGH"
-            annoText = "IN LIB_HIGH"
-
-        # register access
-        if op1 == "1010" and op3 == "1111":
-            register = get_register(op2[0:3])
-            if op2[3] == "0":
-                annoText = "REG WRITE(" + str(register) + ")"
-            else:
-                annoText = "REG READ " + str(register) + ")"
-
-        if op1 == "1011" :
-            annoText = ".MLSD5"
-        if op1 == "1100" :
-            annoText = ".MAEX"
-        if op1 == "1101" :
-            annoText = ".MLSD1"
-        if op1 == "1110" :
-            annoText = ".MMSD1"
-
-        # ALU operations
-        if op1 == "1111" :
-            annoText = self.handle_alu_instructions(irgBits2, op2, op3)
-
-        #if irgBits2 == "1 1001 1111 100 0":  # C1F8 TRIGGER WORD 58/59 "BRANCH 0N C -1F"
-        #    annoText = "BRANCH 0N C -1F"
-
-        return annoText
-
-    def handle_alu_instructions(self, irgBits2, op2, op3):
-        print(irgBits2)
-        annoText = ".MAEX1"
-        opPart = ""
-        operandPart = ""
-        destPart = ""
-
-        if op2 == "0000":
-            operandPart = "A,#const"
-            if op3[0] == "0":
-                opPart = "ADD"
-            else:
-                opPart = "SUB"
-        if op2 == "0001":
-            if op3[0] == "0":
-                opPart = "OR"
-                operandPart = "B,#const"
-            else:
-                opPart = "NEG"
-                operandPart = "B|#const"
-        if op2 == "0010":
-            operandPart = "C,#const"
-            if op3[0] == "0":
-                opPart = "ADD"
-            else:
-                opPart = "SUB"
-        if op2 == "0001":
-            if op3[0] == "0":
-                opPart = "OR"
-                operandPart = "D,#const"
-            else:
-                opPart = "NEG"
-                operandPart = "D|#const"
-        if op2 == "0100":
-            operandPart = "A[,#const]"
-            if op3[0] == "0":
-                opPart = "SHL"
-            else:
-                opPart = "SHR"
-        if op2 == "0101":
-            operandPart = "B[,#const]"
-            if op3[0] == "0":
-                opPart = "SHL"
-            else:
-                opPart = "SHR"
-        if op2 == "0110":
-            operandPart = "C[,#const]"
-            if op3[0] == "0":
-                opPart = "SHL"
-            else:
-                opPart = "SHR"
-        if op2 == "0111":
-            operandPart = "D[,#const]"
-            if op3[0] == "0":
-                opPart = "SHL"
-            else:
-                opPart = "SHR"
-        if op2 == "1000":
-            operandPart = "A,B[|#const]"
-            if op3[0] == "0":
-                opPart = "ADD"
-            else:
-                opPart = "SUB"
-        if op2 == "1001":
-            operandPart = "C,B[|#const]"
-            if op3[0] == "0":
-                opPart = "ADD"
-            else:
-                opPart = "SUB"
-        if op2 == "1010":
-            operandPart = "C,D[|#const]"
-            if op3[0] == "0":
-                opPart = "ADD"
-            else:
-                opPart = "SUB"
-        if op2 == "1011":
-            operandPart = "A,D[|#const]"
-            if op3[0] == "0":
-                opPart = "ADD"
-            else:
-                opPart = "SUB"
-        if op2 == "1100":
-            operandPart = "A,IO[|#const]"
-            if op3[0] == "0":
-                opPart = "ADD"
-            else:
-                opPart = "SUB"
-        if op2 == "1101":
-            opPart = "MOV"
-            if op3[0] == "0":
-                operandPart = "#const"
-            else:
-                operandPart = "-#const"
-        if op2 == "1110":
-            operandPart = "C,IO[|#const]"
-            if op3[0] == "0":
-                opPart = "ADD"
-            else:
-                opPart = "SUB"
-        if op2 == "1111":
-            operandPart = "R5[|#const]"
-            opPart = "MOV"
-        op3part = op3[1:]
-        if op3part == "000": destPart = "A"
-        if op3part == "001": destPart = "IO"
-        if op3part == "010":
-            destPart = "A,B"
-            opPart = "XCH"
-            operandPart = ""
-        if op3part == "011": destPart = "B"
-        if op3part == "100": destPart = "C"
-        if op3part == "101":
-            destPart = "C,D"
-            opPart = "XCH"
-            operandPart = ""
-        if op3part == "110": destPart = "D"
-        if op3part == "111":
-            destPart = "A,E"
-            opPart = "XCH"
-            operandPart = ""
-        annoText += " " + opPart + " " + destPart
-        if operandPart != "":
-            annoText += "," + operandPart
-
-        print(annoText)
-        return annoText
\ No newline at end of file
+                        m.undecoded[instruction] = m.undecoded.get(instruction, 0) + 1
+
+                    self.put_record(record)
+
+            self.end_of_cycle()
+
+    def get_instruction(self, word):
+        return MNEMONICS[word]
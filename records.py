@@ -0,0 +1,54 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Instruction trace records.
+#
+# The decoder puts one record per instruction cycle on its OUTPUT_PYTHON
+# and OUTPUT_BINARY outputs, the offline tools produce the same records:
+#
+#   ss       start of the instruction cycle (IDLE LO)
+#   es       end of s14, where the words are complete
+#   irg      IRG word, bit N read in state sN (instruction word: irg >> 3)
+#   ext      EXT word, same bit order
+#   io       IO bus word, the IO8..IO1 nibble read in state sN at bits
+#            4N..4N+3 (IO8 most significant)
+#   mode     Mode (0: CALCULATE, 1: DISPLAY)
+#   opclass  OpClass of the instruction word
+#
+# The binary form is little endian without padding, RECORD.size (30) bytes
+# per record, so a file of concatenated records can be memory-mapped as an
+# array (see tools/offline.py, RECORD_DTYPE).
+
+import collections
+import struct
+
+RECORD_FIELDS = ('ss', 'es', 'irg', 'ext', 'io', 'mode', 'opclass')
+
+RECORD = struct.Struct('<qqHHQBB')
+
+Record = collections.namedtuple('Record', RECORD_FIELDS)
+
+
+def pack_record(record):
+    return RECORD.pack(*record)
+
+
+def unpack_records(data):
+    # bytes of concatenated records -> Records
+    return [Record._make(r) for r in RECORD.iter_unpack(data)]
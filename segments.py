@@ -0,0 +1,68 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# CALCULATE/DISPLAY mode segments.
+#
+# The mode is read at s1 of every instruction cycle, but changes only a few
+# times per second. ModeSegments merges consecutive cycles of the same mode
+# into one segment [ss, es, mode, cycles], from the start of its first
+# cycle to the start of the first cycle of the next segment (or to the end
+# of its last cycle for the last one), so a capture is a handful of
+# segments. add() returns a segment once it is complete, to annotate it.
+
+
+class ModeSegments:
+    def __init__(self):
+        self.segments = []
+
+    def __len__(self):
+        return len(self.segments)
+
+    def add(self, ss, es, mode, cycles=1):
+        # Adds cycles instruction cycles of mode from ss to es. Returns the
+        # previous segment if this starts a new one, else None.
+        last = self.segments[-1] if self.segments else None
+        if last and last[2] == mode:
+            last[1] = es
+            last[3] += cycles
+            return None
+        if last:
+            last[1] = ss
+        self.segments.append([ss, es, mode, cycles])
+        return last
+
+    def last(self):
+        return self.segments[-1] if self.segments else None
+
+    def counts(self, modes):
+        # number of segments per mode
+        counts = modes * [0]
+        for segment in self.segments:
+            counts[segment[2]] += 1
+        return counts
+
+    def to_dict(self):
+        return {'segments': [list(segment) for segment in self.segments]}
+
+    @classmethod
+    def from_dict(cls, values):
+        segments = cls()
+        for ss, es, mode, cycles in values['segments']:
+            segments.segments.append([ss, es, mode, cycles])
+        return segments
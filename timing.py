@@ -0,0 +1,159 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Instruction cycle timing statistics.
+#
+# Cycle times are kept as integer sample counts (start of one instruction
+# cycle to the start of the next) in histograms per mode and per
+# instruction class. A capture only has a few dozen distinct cycle times,
+# so a histogram is a dict of cycle time -> [count, start of the first
+# such cycle], updated as the cycles come in, and percentiles are read off
+# it at the end. Cycles longer than OUTLIER_FACTOR times the median of
+# their mode are reported as stretched (e.g. waiting for a key, or a
+# glitch on IDLE).
+#
+# DurationTexts formats cycle times for annotations: only when they are
+# needed, and once per distinct sample count.
+
+OUTLIER_FACTOR = 1.5
+PERCENTILES = (50, 90, 99)
+
+
+class Histogram:
+    def __init__(self):
+        self.bins = {}
+        self.count = 0
+
+    def add(self, duration, ss, count=1):
+        entry = self.bins.get(duration)
+        if entry is None:
+            self.bins[duration] = [count, ss]
+        else:
+            entry[0] += count
+            if ss < entry[1]:
+                entry[1] = ss
+        self.count += count
+
+    def percentile(self, p):
+        # Smallest cycle time with at least p percent of the cycles at or
+        # below it.
+        rank = p * self.count / 100
+        seen = 0
+        for duration in sorted(self.bins):
+            seen += self.bins[duration][0]
+            if seen >= rank:
+                return duration
+        return None
+
+    def above(self, limit):
+        # (cycle time, count, first start) of the bins above limit, longest
+        # first
+        return [(duration, count, ss) for duration, (count, ss)
+                in sorted(self.bins.items(), reverse=True) if duration > limit]
+
+    def to_dict(self):
+        # The bins are copied: add() updates them in place, and pd.py keeps
+        # this dict as the metrics snapshot of the last cycle boundary.
+        return {str(duration): list(entry) for duration, entry in self.bins.items()}
+
+    @classmethod
+    def from_dict(cls, values):
+        histogram = cls()
+        for duration, (count, ss) in values.items():
+            histogram.add(int(duration), ss, count)
+        return histogram
+
+
+class CycleTiming:
+    def __init__(self, modes, opclasses):
+        self.by_mode = [Histogram() for _ in range(modes)]
+        self.by_opclass = [Histogram() for _ in range(opclasses)]
+        # start, mode and class of the last cycle, its time is known once
+        # the next one starts
+        self.last = None
+
+    def add(self, duration, ss, mode, opclass, count=1):
+        self.by_mode[mode].add(duration, ss, count)
+        self.by_opclass[opclass].add(duration, ss, count)
+
+    def cycle(self, ss, mode, opclass):
+        # An instruction cycle starting at ss, ending the one before
+        last = self.last
+        if last is not None:
+            self.add(ss - last[0], last[0], last[1], last[2])
+        self.last = (ss, mode, opclass)
+
+    def outliers(self, mode):
+        histogram = self.by_mode[mode]
+        if not histogram.count:
+            return []
+        return histogram.above(OUTLIER_FACTOR * histogram.percentile(50))
+
+    def report(self, text, mode_names, opclass_names):
+        # Report lines, text(samples) formats a cycle time.
+        def line(name, histogram):
+            return '%s: %d cycles, min %s, %s, max %s' % (
+                name, histogram.count, text(min(histogram.bins)),
+                ', '.join('p%d %s' % (p, text(histogram.percentile(p)))
+                          for p in PERCENTILES),
+                text(max(histogram.bins)))
+
+        lines = []
+        for mode, histogram in enumerate(self.by_mode):
+            if histogram.count:
+                lines.append('Cycle time ' + line(mode_names[mode], histogram))
+                stretched = self.outliers(mode)
+                if stretched:
+                    duration, _, ss = stretched[0]
+                    lines.append('Stretched %s cycles: %d (%d distinct times), longest %s at sample %d' % (
+                        mode_names[mode], sum(count for _, count, _ in stretched),
+                        len(stretched), text(duration), ss))
+        for opclass, histogram in enumerate(self.by_opclass):
+            if histogram.count:
+                lines.append('Cycle time ' + line(opclass_names[opclass], histogram))
+        return lines
+
+    def to_dict(self):
+        return {
+            'by_mode': [h.to_dict() for h in self.by_mode],
+            'by_opclass': [h.to_dict() for h in self.by_opclass],
+            'last': self.last,
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        timing = cls(0, 0)
+        timing.by_mode = [Histogram.from_dict(h) for h in values['by_mode']]
+        timing.by_opclass = [Histogram.from_dict(h) for h in values['by_opclass']]
+        timing.last = tuple(values['last']) if values['last'] else None
+        return timing
+
+
+class DurationTexts:
+    # Memoized format(samples / samplerate) per sample count
+    def __init__(self, samplerate, format):
+        self.samplerate = samplerate
+        self.format = format
+        self.texts = {}
+
+    def __call__(self, samples):
+        text = self.texts.get(samples)
+        if text is None:
+            text = self.texts[samples] = self.format(samples / self.samplerate)
+        return text
@@ -0,0 +1,38 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''
+Offline tools for TI-5x captures, running without libsigrokdecode.
+
+Run them from the decoder directory, e.g.:
+
+    python3 -m tools.offline examples/ti59-session001-4secs-5mhz-switch-on.sr
+
+'''
+
+import os
+import sys
+
+# The decoder modules next to pd.py are not an installable package. Make
+# the ones without a sigrokdecode dependency (e.g. instructions.py)
+# importable as top-level modules.
+_decoder_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _decoder_dir not in sys.path:
+    sys.path.insert(0, _decoder_dir)
@@ -0,0 +1,246 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Batch decoding of a directory of captures.
+#
+# Every capture (*.sr, also in subdirectories) is decoded by one worker
+# process of a pool. The summary of a capture (instruction cycles, hit
+# rate, cycles per mode, undecoded instruction words, cycle time
+# statistics) is kept next to it as <capture>.sr.summary.json, together
+# with the capture's cache key (sample data, samplerate and decoder
+# version, see cache.py). A capture whose summary has the current key is
+# not decoded again.
+#
+# The summaries are printed as one table per calculator unit. The unit of
+# a capture is taken from its path relative to the directory with
+# --unit-pattern, by default the subdirectory or the part of the file
+# name before the first '-' (e.g. 'ti59' for ti59-session001-....sr).
+#
+#   python3 -m tools.batch -j 8 captures/
+#   python3 -m tools.batch captures/ --csv summary.csv
+
+import argparse
+import concurrent.futures
+import csv
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from instructions import formatter
+from timing import CycleTiming
+from .cache import capture_key
+from .offline import MODE_NAMES, OPCLASS_NAMES, add_timing, decode_file
+from .srfile import SrFile
+
+SUMMARY_SUFFIX = '.summary.json'
+SUMMARY_VERSION = 1
+DEFAULT_UNIT_PATTERN = r'^([^-/\\]+)'
+
+COLUMNS = ('unit', 'capture', 'samples', 'seconds', 'cycles', 'hit_rate',
+           'calculate', 'display', 'calculate_p50_us', 'calculate_p99_us',
+           'display_p50_us', 'display_p99_us', 'stretched', 'undecoded')
+
+
+def summary_path(path):
+    return path + SUMMARY_SUFFIX
+
+
+def find_captures(directory):
+    captures = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        captures += [os.path.join(root, name) for name in sorted(files)
+                     if name.endswith('.sr')]
+    return captures
+
+
+def load_summary(path, key):
+    # The stored summary of a capture if it is up to date, else None.
+    try:
+        with open(summary_path(path)) as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if summary.get('version') != SUMMARY_VERSION or summary.get('key') != key:
+        return None
+    return summary
+
+
+def summarize(path, key):
+    # Decode a capture and store its summary (runs in a worker process).
+    begin = time.perf_counter()
+    with SrFile(path) as capture:
+        samplerate = capture.samplerate
+        num_samples = capture.num_samples
+    timing = CycleTiming(len(MODE_NAMES), len(OPCLASS_NAMES))
+    mode_cycles = [0] * len(MODE_NAMES)
+    undecoded = {}
+    cycles = 0
+    for records in decode_file(path):
+        cycles += len(records)
+        add_timing(timing, records)
+        for mode, count in enumerate(np.bincount(records['mode'], minlength=len(MODE_NAMES)).tolist()):
+            mode_cycles[mode] += count
+        for word in (records['irg'][records['opclass'] == 0] >> 3).tolist():
+            undecoded[word] = undecoded.get(word, 0) + 1
+    summary = {
+        'version': SUMMARY_VERSION,
+        'key': key,
+        'capture': os.path.basename(path),
+        'samplerate': samplerate,
+        'samples': num_samples,
+        'cycles': cycles,
+        'decoded': cycles - sum(undecoded.values()),
+        'mode_cycles': mode_cycles,
+        'undecoded': {str(word): count for word, count in undecoded.items()},
+        'timing': timing.to_dict(),
+        'seconds': time.perf_counter() - begin,
+    }
+    tmp = summary_path(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(summary, f)
+    os.replace(tmp, summary_path(path))
+    return summary
+
+
+def table_row(unit, summary):
+    # One row of the unit table, see COLUMNS.
+    timing = CycleTiming.from_dict(summary['timing'])
+    us = 1e6 / summary['samplerate']
+    row = {
+        'unit': unit,
+        'capture': summary['capture'],
+        'samples': summary['samples'],
+        'seconds': summary['samples'] / summary['samplerate'],
+        'cycles': summary['cycles'],
+        'hit_rate': summary['decoded'] / summary['cycles'] if summary['cycles'] else 0.0,
+        'calculate': summary['mode_cycles'][0],
+        'display': summary['mode_cycles'][1],
+        'stretched': sum(count for mode in range(len(MODE_NAMES))
+                         for _, count, _ in timing.outliers(mode)),
+        'undecoded': ' '.join(
+            formatter.format('{:04H}x{}', int(word), count)
+            for word, count in sorted(summary['undecoded'].items(),
+                                      key=lambda item: -item[1])),
+    }
+    for mode, name in enumerate(MODE_NAMES):
+        histogram = timing.by_mode[mode]
+        for p in (50, 99):
+            value = histogram.percentile(p) if histogram.count else None
+            row['%s_p%d_us' % (name.lower(), p)] = None if value is None else value * us
+    return row
+
+
+def print_tables(out, rows):
+    # One table per unit, with a total line.
+    def us(value):
+        return '-' if value is None else '%.1f' % value
+
+    units = {}
+    for row in rows:
+        units.setdefault(row['unit'], []).append(row)
+    for unit in sorted(units):
+        out.write('\n%s\n' % unit)
+        out.write('%-48s %8s %8s %8s %8s %8s %15s %15s %9s  %s\n' % (
+            'capture', 'seconds', 'cycles', 'hit %', 'CALC', 'DISP',
+            'CALC p50/p99 us', 'DISP p50/p99 us', 'stretched', 'undecoded'))
+        for row in units[unit]:
+            out.write('%-48s %8.1f %8d %8.2f %8d %8d %15s %15s %9d  %s\n' % (
+                row['capture'], row['seconds'], row['cycles'], 100 * row['hit_rate'],
+                row['calculate'], row['display'],
+                us(row['calculate_p50_us']) + '/' + us(row['calculate_p99_us']),
+                us(row['display_p50_us']) + '/' + us(row['display_p99_us']),
+                row['stretched'], row['undecoded']))
+        total = units[unit]
+        cycles = sum(row['cycles'] for row in total)
+        decoded = sum(row['hit_rate'] * row['cycles'] for row in total)
+        out.write('%-48s %8.1f %8d %8.2f %8d %8d\n' % (
+            'total (%d captures)' % len(total), sum(row['seconds'] for row in total),
+            cycles, 100 * decoded / cycles if cycles else 0.0,
+            sum(row['calculate'] for row in total), sum(row['display'] for row in total)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Decode all TI-5x captures of a directory and summarize them per unit.')
+    parser.add_argument('directory', help='directory with sigrok session files (.sr)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of processes (default: number of cores)')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='decode all captures, even if their summary is up to date')
+    parser.add_argument('-u', '--unit-pattern', default=DEFAULT_UNIT_PATTERN,
+                        help='regular expression, its first group in the path of a capture '
+                             'relative to the directory is the unit (default: %(default)s)')
+    parser.add_argument('--csv', metavar='FILE', help='also write the table to FILE')
+    args = parser.parse_args(argv)
+
+    unit_pattern = re.compile(args.unit_pattern)
+    captures = find_captures(args.directory)
+    summaries = {}
+    todo = []
+    for path in captures:
+        with SrFile(path) as capture:
+            key = capture_key(capture)
+        summary = None if args.force else load_summary(path, key)
+        if summary:
+            summaries[path] = summary
+        else:
+            todo.append((path, key))
+    print('%d captures, %d up to date, decoding %d' % (
+        len(captures), len(summaries), len(todo)), file=sys.stderr)
+
+    begin = time.perf_counter()
+    if todo:
+        with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+            futures = {pool.submit(summarize, path, key): path for path, key in todo}
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]
+                try:
+                    summaries[path] = future.result()
+                except Exception as e:
+                    print('%s: %s' % (path, e), file=sys.stderr)
+                    continue
+                print('%s: %d instruction cycles, %.1f s' % (
+                    path, summaries[path]['cycles'], summaries[path]['seconds']),
+                    file=sys.stderr)
+    if todo:
+        print('decoded %d captures in %.1f s' % (
+            len(todo), time.perf_counter() - begin), file=sys.stderr)
+
+    rows = []
+    for path in captures:
+        if path not in summaries:
+            continue
+        match = unit_pattern.search(os.path.relpath(path, args.directory))
+        unit = match.group(1) if match and match.groups() else 'unknown'
+        rows.append(table_row(unit, summaries[path]))
+    print_tables(sys.stdout, rows)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Decoder throughput benchmark.
+#
+# Runs every engine on every capture in a fresh process and reports
+# samples/s, instruction cycles/s, peak RSS and the number of annotations.
+# Engines:
+#
+#   pd       pd.Decoder.decode(), fed by the srdmock replay (so this
+#            includes the overhead of the Python wait() implementation)
+#   offline  the NumPy engine of tools/offline.py
+#
+# With --repeat N the chunks of a capture are replayed N times, to see how
+# throughput and memory hold up on large inputs.
+#
+#   python3 -m tools.bench -o bench.json
+#   python3 -m tools.bench --engine offline --repeat 20 --compare bench.json
+
+import argparse
+import concurrent.futures
+import datetime
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from . import srdmock
+from .offline import OfflineDecoder
+from .srfile import SrFile
+
+
+class Counter:
+    # Pass chunks through, counting the samples.
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.samples = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.samples += len(chunk)
+            yield chunk
+
+
+def repeated_chunks(capture, repeat):
+    for _ in range(repeat):
+        yield from capture.chunks()
+
+
+def bench_pd(capture, repeat):
+    package = srdmock.install()
+    chunks = Counter(repeated_chunks(capture, repeat))
+    decoder = package.Decoder()
+    replay = srdmock.Replay(decoder, chunks, capture.samplerate)
+    replay.keep = False
+    start = time.perf_counter()
+    replay.run()
+    elapsed = time.perf_counter() - start
+    return {
+        'samples': chunks.samples,
+        'cycles': decoder.metrics.cycles,
+        'annotations': replay.annotations,
+        'seconds': elapsed,
+    }
+
+
+def bench_offline(capture, repeat):
+    chunks = Counter(repeated_chunks(capture, repeat))
+    decoder = OfflineDecoder()
+    cycles = 0
+    start = time.perf_counter()
+    for samples in chunks:
+        cycles += len(decoder.feed(samples))
+    cycles += len(decoder.flush())
+    elapsed = time.perf_counter() - start
+    return {
+        'samples': chunks.samples,
+        'cycles': cycles,
+        'annotations': None,
+        'seconds': elapsed,
+    }
+
+
+ENGINES = {
+    'pd': bench_pd,
+    'offline': bench_offline,
+}
+
+
+def run_one(path, engine, repeat):
+    with SrFile(path) as capture:
+        result = ENGINES[engine](capture, repeat)
+        result['samplerate'] = capture.samplerate
+    result.update({
+        'capture': os.path.basename(path),
+        'engine': engine,
+        'repeat': repeat,
+        'samples_per_s': result['samples'] / result['seconds'],
+        'cycles_per_s': result['cycles'] / result['seconds'],
+        # ru_maxrss is in kB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+    return result
+
+
+def run_isolated(path, engine, repeat):
+    # A fresh process per run, so that peak RSS belongs to this run only.
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(run_one, path, engine, repeat).result()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    previous = {}
+    for result in (baseline or {}).get('results', []):
+        previous[(result['capture'], result['engine'], result['repeat'])] = result
+    print('%-45s %-8s %4s %12s %10s %12s %9s %12s' % (
+        'capture', 'engine', 'rep', 'samples', 'seconds', 'Msamples/s',
+        'cycles/s', 'annotations'), end='')
+    print('  peak RSS' + ('  vs base' if baseline else ''))
+    for r in results:
+        line = '%-45s %-8s %4d %12d %10.3f %12.2f %9.0f %12s %7.1f MB' % (
+            r['capture'], r['engine'], r['repeat'], r['samples'], r['seconds'],
+            r['samples_per_s'] / 1e6, r['cycles_per_s'],
+            '-' if r['annotations'] is None else r['annotations'],
+            r['peak_rss_mb'])
+        old = previous.get((r['capture'], r['engine'], r['repeat']))
+        if old:
+            line += '  %6.2fx' % (r['samples_per_s'] / old['samples_per_s'])
+        print(line)
+
+
+def main(argv=None):
+    decoder_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='Benchmark the TI-5x decoders.')
+    parser.add_argument('captures', nargs='*',
+                        default=sorted(glob.glob(os.path.join(decoder_dir, 'examples', '*.sr'))),
+                        help='sigrok session files (default: the examples)')
+    parser.add_argument('-e', '--engine', action='append', choices=sorted(ENGINES),
+                        help='engine to run, may be repeated (default: all)')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='replay the chunks of every capture N times')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('-c', '--compare', help='JSON file of an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    results = []
+    for path in args.captures:
+        for engine in args.engine or list(ENGINES):
+            results.append(run_isolated(path, engine, args.repeat))
+            print('%s/%s: %.3f s' % (os.path.basename(path), engine,
+                                     results[-1]['seconds']), file=sys.stderr)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# On-disk cache of decoded instruction traces.
+#
+# Entries are content-addressed: the key is a hash of the capture's sample
+# chunks, its samplerate and unit size, and the version of the decoder
+# (a hash of the sources that determine the records). Instead of the
+# samples themselves, the CRC32 and size of every chunk, as stored in the
+# zip directory of the .sr file, are hashed, so computing a key does not
+# decompress anything. Renaming or copying a capture keeps its entry,
+# changing it or the decoder makes a new one.
+#
+# An entry is an uncompressed .npz file with one array per record field
+# (see records.py). Loading it takes milliseconds. Entries are touched on
+# every hit and the least recently used ones are removed when the cache
+# grows beyond its size limit.
+#
+#   python3 -m tools.cache capture.sr            decode, or load from cache
+#   python3 -m tools.cache --info                list cached traces
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+import numpy as np
+
+from records import RECORD_FIELDS
+from .offline import RECORD_DTYPE, decode_file, print_records
+from .srfile import SrFile
+
+DEFAULT_MAX_BYTES = 1 << 30
+
+# Sources the decoded records depend on.
+DECODER_SOURCES = ('instructions.py', 'records.py', 'clock.py', 'tools/offline.py',
+                   'tools/srfile.py')
+
+
+def default_directory():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ti5x')
+
+
+def decoder_version():
+    decoder_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.blake2b(digest_size=8)
+    for name in DECODER_SOURCES:
+        with open(os.path.join(decoder_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def capture_key(capture, version=None):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(('%d %d %s\n' % (capture.samplerate, capture.unitsize,
+                                   version or decoder_version())).encode())
+    for name in capture.chunk_names:
+        info = capture.zip.getinfo(name)
+        digest.update(('%08x %d\n' % (info.CRC, info.file_size)).encode())
+    return digest.hexdigest()
+
+
+class TraceCache:
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        # The cached records, or None.
+        path = self.path(key)
+        try:
+            with np.load(path) as columns:
+                records = np.empty(len(columns['ss']), dtype=RECORD_DTYPE)
+                for field in RECORD_FIELDS:
+                    records[field] = columns[field]
+        except (OSError, KeyError, ValueError):
+            return None
+        os.utime(path)
+        return records
+
+    def put(self, key, records):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **{field: records[field] for field in RECORD_FIELDS})
+        os.replace(tmp, path)
+        self.evict()
+
+    def entries(self):
+        # (path, size, last use) of all entries, least recently used first
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith('.npz')]
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, max_bytes=None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def decode_cached(path, cache=None):
+    # All records of a capture and whether they came from the cache.
+    cache = cache or TraceCache()
+    with SrFile(path) as capture:
+        key = capture_key(capture)
+    records = cache.get(key)
+    if records is not None:
+        return records, True
+    records = np.concatenate(list(decode_file(path)))
+    cache.put(key, records)
+    return records, False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Decode a TI-5x capture, using a cache of decoded traces.')
+    parser.add_argument('capture', nargs='?', help='sigrok session file (.sr)')
+    parser.add_argument('-d', '--directory',
+                        help='cache directory (default: %s)' % default_directory())
+    parser.add_argument('-m', '--max-mb', type=float, default=DEFAULT_MAX_BYTES / (1 << 20),
+                        help='evict least recently used traces beyond this size')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only print the summary')
+    parser.add_argument('--info', action='store_true', help='list the cached traces')
+    parser.add_argument('--clear', action='store_true', help='remove all cached traces')
+    args = parser.parse_args(argv)
+
+    cache = TraceCache(args.directory, int(args.max_mb * (1 << 20)))
+    cache.evict(0 if args.clear else None)
+    if args.info:
+        entries = cache.entries()
+        for path, size, used in entries:
+            print('%s %10d %s' % (os.path.basename(path), size,
+                                  time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(used))))
+        print('%d traces, %d bytes in %s' % (len(entries), sum(e[1] for e in entries),
+                                             cache.directory))
+    if not args.capture:
+        return
+
+    with SrFile(args.capture) as capture:
+        samplerate = capture.samplerate
+    begin = time.perf_counter()
+    records, hit = decode_cached(args.capture, cache)
+    elapsed = time.perf_counter() - begin
+    if not args.quiet:
+        print_records(sys.stdout, records, samplerate, 0)
+    print('%d instruction cycles, %s, %.3f s' % (
+        len(records), 'cached' if hit else 'decoded', elapsed), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
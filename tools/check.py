@@ -0,0 +1,177 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Regression check of the two decoder engines, pd.py and tools/offline.py,
+# which must produce the same records (see records.py):
+#
+#  - synthetic captures (tools/synth.py) in both modes at several
+#    samplerates, with PHI1 jitter and the clocks of both calculators,
+#    decoded by both engines and compared with the records they were
+#    synthesized from,
+#  - the start of every example capture, decoded by both engines and
+#    compared with each other,
+#  - a synthetic capture of printer instructions loading and printing
+#    PRINTER_TEXT, with a print code of non-octal digits in between, whose
+#    line tools/printer.py must rebuild.
+#
+# Exits with status 1 if anything differs, so it can guard changes to
+# either engine:
+#
+#   python3 -m tools.check
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+from instructions import MNEMONICS
+from . import srdmock
+from .offline import RECORD_DTYPE, OfflineDecoder
+from .printer import CHARSET, COLUMNS, Printer
+from .srfile import SrFile
+from .synth import Checker, Synthesizer, batches, decode_offline, decode_pd, parse_modes
+
+# (samplerate, PHI1 jitter in samples, clock) of the synthetic captures
+SYNTH_CASES = ((1e6, 0, 'ti58c'), (3e6, 0, 'ti59'), (5e6, 1, 'ti59'), (10e6, 2, 'ti59'))
+SYNTH_CYCLES = 3000
+SYNTH_MODES = 'C300,D200'
+EXAMPLE_SECONDS = 0.8
+PRINTER_TEXT = 'PC-100A 1.5'
+
+
+def check_synth(engine, samplerate, jitter, clock, cycles=SYNTH_CYCLES):
+    # Number of records that differ from the synthesized ones.
+    synthesizer = Synthesizer(samplerate, jitter, seed=1, clock=clock)
+    words = np.arange(8192)
+    chunks = batches(synthesizer, words, parse_modes(SYNTH_MODES), cycles, 'random',
+                     batch_cycles=500)
+    checker = Checker()
+    if engine == 'pd':
+        decode_pd(chunks, checker, samplerate)
+    else:
+        decode_offline(chunks, checker)
+    return checker.mismatches + len(checker.expected) + abs(checker.cycles - cycles)
+
+
+def check_printer(samplerate=5e6):
+    # (lines printed, bad print codes) of PRT_CLEAR, one OUT PRT per
+    # character of PRINTER_TEXT plus one with the code 8F, and PRT_PRINT.
+    program = [('PRT_CLEAR', 0)]
+    for i, char in enumerate(PRINTER_TEXT):
+        code = CHARSET.index(char)
+        program.append(('OUT PRT', (code >> 3) << 4 | (code & 7)))
+        if i == len(PRINTER_TEXT) // 2:
+            program.append(('OUT PRT', 0x8F))
+    program.append(('PRT_PRINT', 0))
+    irg = np.array([MNEMONICS.index(text) << 3 for text, _ in program])
+    io = np.array([io for _, io in program], dtype=np.uint64)
+    zeros = np.zeros(len(program), dtype=np.int64)
+
+    synthesizer = Synthesizer(samplerate, seed=1)
+    decoder = OfflineDecoder()
+    printer = Printer()
+    for samples, _ in (synthesizer.cycles(irg, zeros, io, zeros), synthesizer.finish()):
+        printer.add(decoder.feed(samples))
+    printer.add(decoder.flush())
+    return [text for _, text, _ in printer.output], printer.bad_codes
+
+
+def slice_chunks(capture, samples):
+    # The chunks of capture up to sample number samples.
+    seen = 0
+    for chunk in capture.chunks():
+        if seen + len(chunk) >= samples:
+            yield chunk[:samples - seen]
+            return
+        seen += len(chunk)
+        yield chunk
+
+
+def pd_records(path, samples):
+    package = srdmock.install()
+    with SrFile(path) as capture:
+        decoder = package.Decoder()
+        replay = srdmock.Replay(decoder, slice_chunks(capture, samples), capture.samplerate)
+        replay.run()
+    return np.array([tuple(data[1]) for _, _, output, data in replay.puts
+                     if output == srdmock.OUTPUT_PYTHON], dtype=RECORD_DTYPE)
+
+
+def offline_records(path, samples):
+    with SrFile(path) as capture:
+        decoder = OfflineDecoder()
+        records = [decoder.feed(chunk) for chunk in slice_chunks(capture, samples)]
+    records.append(decoder.flush())
+    return np.concatenate(records)
+
+
+def check_example(path, seconds=EXAMPLE_SECONDS):
+    # (records, number of records that differ between the engines)
+    with SrFile(path) as capture:
+        samples = int(seconds * capture.samplerate)
+    a, b = pd_records(path, samples), offline_records(path, samples)
+    n = min(len(a), len(b))
+    return len(a), int((a[:n] != b[:n]).sum()) + abs(len(a) - len(b))
+
+
+def main(argv=None):
+    decoder_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='Check that the TI-5x decoders agree.')
+    parser.add_argument('captures', nargs='*',
+                        default=sorted(glob.glob(os.path.join(decoder_dir, 'examples', '*.sr'))),
+                        help='sigrok session files (default: the examples)')
+    parser.add_argument('-s', '--seconds', type=float, default=EXAMPLE_SECONDS,
+                        help='length of the start of every capture to compare (default: %g)'
+                        % EXAMPLE_SECONDS)
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for samplerate, jitter, clock in SYNTH_CASES:
+        for engine in ('pd', 'offline'):
+            begin = time.perf_counter()
+            differ = check_synth(engine, samplerate, jitter, clock)
+            failed += differ > 0
+            print('synth %-5s %4.0f MHz jitter %d %-8s %s (%.1f s)' % (
+                clock, samplerate / 1e6, jitter, engine,
+                'ok' if not differ else '%d records differ' % differ,
+                time.perf_counter() - begin))
+    begin = time.perf_counter()
+    lines, bad_codes = check_printer()
+    differ = lines != [PRINTER_TEXT.rjust(COLUMNS)] or bad_codes != 1
+    failed += differ
+    print('printer %-37s %s (%.1f s)' % (
+        repr(PRINTER_TEXT), 'ok' if not differ else 'printed %r, %d bad print codes' % (
+            lines, bad_codes), time.perf_counter() - begin))
+    for path in args.captures:
+        begin = time.perf_counter()
+        cycles, differ = check_example(path, args.seconds)
+        failed += differ > 0 or not cycles
+        print('%-45s pd/offline %s, %d cycles (%.1f s)' % (
+            os.path.basename(path), 'ok' if not differ else '%d records differ' % differ,
+            cycles, time.perf_counter() - begin))
+    if failed:
+        print('%d checks failed' % failed, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Columnar export of decoded instruction traces.
+#
+# Writes one row per instruction cycle with the columns of EXPORT_DTYPE:
+#
+#   ss, es    start of the cycle and end of s14 (see records.py)
+#   length    cycle time in samples, up to the start of the next cycle (0
+#             for the last cycle, which has no end)
+#   irg, ext  IRG and EXT word
+#   io        IO bus word
+#   mode      0: CALCULATE, 1: DISPLAY
+#   opclass   instruction class (instructions.OpClass)
+#
+# as a NumPy .npy file (default), an Arrow IPC file (.arrow) or a Parquet
+# file (.parquet), the latter two need pyarrow. The input is a capture
+# (.sr), decoded chunk by chunk, or a binary trace of the decoder (see
+# readme.md). Rows are written in batches as they are decoded, so memory
+# use does not depend on the length of the trace.
+#
+# A .npy export is read back memory-mapped with load_columns(), an .arrow
+# export as an Arrow table referencing the mapped file, both without
+# copying:
+#
+#   python3 -m tools.export capture.sr capture.npy
+#   python3 -m tools.export capture.trace capture.parquet
+
+import argparse
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from .offline import RECORD_DTYPE, decode_file, load_trace
+
+EXPORT_DTYPE = np.dtype([('ss', '<i8'), ('es', '<i8'), ('length', '<i8'),
+                         ('irg', '<u2'), ('ext', '<u2'), ('io', '<u8'),
+                         ('mode', 'u1'), ('opclass', 'u1')])
+FORMATS = ('npy', 'arrow', 'parquet')
+BATCH_ROWS = 1 << 16
+
+
+def trace_batches(path):
+    # Record arrays of a capture or a binary trace file.
+    if path.endswith('.sr'):
+        yield from decode_file(path)
+    else:
+        trace = load_trace(path)
+        for start in range(0, len(trace), BATCH_ROWS):
+            yield trace[start:start + BATCH_ROWS]
+
+
+def export_batches(batches):
+    # Record arrays -> EXPORT_DTYPE arrays. The last record of every batch
+    # is held back until the start of the next cycle is known.
+    pending = np.empty(0, dtype=RECORD_DTYPE)
+    for records in batches:
+        if not len(records):
+            continue
+        records = np.concatenate((pending, records))
+        pending = records[-1:]
+        rows = to_rows(records[:-1])
+        rows['length'] = np.diff(records['ss'])
+        yield rows
+    if len(pending):
+        rows = to_rows(pending)
+        rows['length'] = 0
+        yield rows
+
+
+def to_rows(records):
+    rows = np.empty(len(records), dtype=EXPORT_DTYPE)
+    for name in RECORD_DTYPE.names:
+        rows[name] = records[name]
+    return rows
+
+
+class NpyWriter:
+    # .npy file written in batches: the header has room for any row count
+    # and is rewritten with the actual one when the file is closed.
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.rows = 0
+        self.header_size = None
+        self.header_size = len(self.header(1 << 62))
+        self.f.write(self.header(0))
+
+    def header(self, rows):
+        # magic, version 1.0, header length and the header dict, padded
+        # with spaces to a multiple of 64 bytes (so the rows are aligned)
+        text = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+            np.lib.format.dtype_to_descr(EXPORT_DTYPE), rows)
+        size = self.header_size or -(-(10 + len(text) + 1) // 64) * 64
+        text = text.ljust(size - 10 - 1) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', size - 10) + text.encode('latin1')
+
+    def write(self, rows):
+        self.f.write(rows.tobytes())
+        self.rows += len(rows)
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(self.header(self.rows))
+        self.f.close()
+
+
+def arrow_batch(pa, rows):
+    # the fields of a record array are strided, Arrow wants plain arrays
+    return pa.record_batch([pa.array(np.ascontiguousarray(rows[name]))
+                            for name in EXPORT_DTYPE.names],
+                           names=list(EXPORT_DTYPE.names))
+
+
+def arrow_schema(pa):
+    return arrow_batch(pa, np.empty(0, dtype=EXPORT_DTYPE)).schema
+
+
+class ArrowWriter:
+    # Arrow IPC file, uncompressed so that it can be memory-mapped
+    def __init__(self, path):
+        import pyarrow as pa
+        self.pa = pa
+        self.sink = pa.OSFile(path, 'wb')
+        self.writer = pa.ipc.new_file(self.sink, arrow_schema(pa))
+
+    def write(self, rows):
+        self.writer.write_batch(arrow_batch(self.pa, rows))
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+class ParquetWriter:
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.writer = pq.ParquetWriter(path, arrow_schema(pa))
+
+    def write(self, rows):
+        self.writer.write_table(self.pa.Table.from_batches([arrow_batch(self.pa, rows)]))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {'npy': NpyWriter, 'arrow': ArrowWriter, 'parquet': ParquetWriter}
+
+
+def export(source, path, format='npy'):
+    # Export the trace of source (capture or binary trace) to path,
+    # returns the number of rows.
+    writer = WRITERS[format](path)
+    count = 0
+    try:
+        for rows in export_batches(trace_batches(source)):
+            writer.write(rows)
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
+
+
+def load_columns(path):
+    # An export as a read-only memory-mapped record array (.npy) or an
+    # Arrow table (.arrow, memory-mapped; .parquet, read).
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_table(path, memory_map=True)
+    if path.endswith('.arrow'):
+        import pyarrow as pa
+        return pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return np.load(path, mmap_mode='r')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Export a decoded TI-5x trace as columns (.npy, .arrow, .parquet).')
+    parser.add_argument('source', help='sigrok session file (.sr) or binary trace')
+    parser.add_argument('output', help='output file')
+    parser.add_argument('-f', '--format', choices=FORMATS,
+                        help='output format (default: from the output file name, else npy)')
+    args = parser.parse_args(argv)
+
+    format = args.format or os.path.splitext(args.output)[1][1:]
+    if format not in FORMATS:
+        format = 'npy'
+    begin = time.perf_counter()
+    try:
+        rows = export(args.source, args.output, format)
+    except ImportError as e:
+        sys.exit('%s export needs pyarrow: %s' % (format, e))
+    print('%d instruction cycles, %.3f s' % (rows, time.perf_counter() - begin),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
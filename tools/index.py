@@ -0,0 +1,177 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Seekable instruction index of a capture.
+#
+# A cheap first pass finds all IDLE falling edges, one at the start of
+# every instruction cycle, without looking at the clock or the data lines.
+# The n-th edge is taken as the start of instruction n; glitches on IDLE
+# before the first real instruction cycle may add a few extra edges.
+#
+# The index (a sidecar file next to the capture) holds the sample of every
+# edge plus, for every block of BLOCK_SAMPLES samples, the number of the
+# first instruction starting in or after it. decode_window() uses it to
+# start decoding a few instructions before a time window and decodes only
+# that range, so its cost depends on the size of the window, not on its
+# position in the capture.
+#
+#   python3 -m tools.index capture.sr                 build the index
+#   python3 -m tools.index capture.sr -w 2.5 2.6      decode 2.5 s .. 2.6 s
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from .cache import capture_key
+from .offline import IDLE, print_records
+from .parallel import decode_shard
+from .srfile import SrFile
+
+BLOCK_SAMPLES = 1 << 16
+
+# Instructions decoded before a window, to get in sync with the
+# sequential decoder.
+SYNC_MARGIN = 2
+
+
+def index_path(capture_path):
+    return capture_path + '.index.npz'
+
+
+class SeekIndex:
+    def __init__(self, key, num_samples, starts):
+        self.key = key
+        self.num_samples = num_samples
+        # sample of the IDLE falling edge of every instruction
+        self.starts = starts
+        # first instruction starting at or after every block
+        self.blocks = np.searchsorted(
+            starts, np.arange(0, num_samples + BLOCK_SAMPLES, BLOCK_SAMPLES))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def sample_of(self, instruction):
+        return int(self.starts[instruction])
+
+    def instruction_at(self, sample):
+        # Number of the last instruction starting at or before sample, -1 if
+        # there is none. Only the block's part of the index is searched.
+        block = min(max(sample, 0) // BLOCK_SAMPLES, len(self.blocks) - 2)
+        lo, hi = self.blocks[block], self.blocks[block + 1]
+        return int(lo + np.searchsorted(self.starts[lo:hi], sample, 'right')) - 1
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, key=np.array(self.key), num_samples=self.num_samples,
+                     starts=self.starts)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(str(data['key']), int(data['num_samples']), data['starts'])
+
+
+def build_index(capture):
+    starts = []
+    pos = 0
+    previous = None
+    for samples in capture.chunks():
+        idle = (samples & IDLE).view(np.int8)
+        if previous is not None:
+            idle = np.concatenate(([previous], idle))
+            falls = np.flatnonzero(np.diff(idle) == -1) + pos
+        else:
+            falls = np.flatnonzero(np.diff(idle) == -1) + 1
+        starts.append(falls)
+        previous = idle[-1]
+        pos += len(samples)
+    return SeekIndex(capture_key(capture), pos, np.concatenate(starts).astype(np.int64))
+
+
+def open_index(path, rebuild=False):
+    # The sidecar index of a capture, (re)built if missing or out of date.
+    with SrFile(path) as capture:
+        key = capture_key(capture)
+        if not rebuild:
+            try:
+                index = SeekIndex.load(index_path(path))
+                if index.key == key:
+                    return index
+            except (OSError, KeyError, ValueError):
+                pass
+        index = build_index(capture)
+    try:
+        index.save(index_path(path))
+    except OSError:
+        pass
+    return index
+
+
+def decode_window(path, index, start, stop):
+    # Records of the instruction cycles starting in samples start..stop-1,
+    # and the start of the cycle before them (0 if none), the reference for
+    # the cycle time of the first one.
+    first = index.instruction_at(start) - SYNC_MARGIN
+    if first <= 0:
+        sync = 0
+    else:
+        # the edge is found from the sample before it
+        sync = index.sample_of(first) - 1
+    records = decode_shard(path, sync, stop, 1)
+    before = records['ss'] < start
+    last_start = int(records['ss'][before][-1]) if before.any() else 0
+    return records[~before & (records['ss'] < stop)], last_start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Build a seek index of a TI-5x capture and decode time windows.')
+    parser.add_argument('capture', help='sigrok session file (.sr)')
+    parser.add_argument('-w', '--window', nargs=2, type=float, metavar=('START', 'STOP'),
+                        help='decode the instruction cycles starting in this time window (s)')
+    parser.add_argument('-r', '--rebuild', action='store_true',
+                        help='rebuild the index even if it is up to date')
+    args = parser.parse_args(argv)
+
+    with SrFile(args.capture) as capture:
+        samplerate = capture.samplerate
+
+    begin = time.perf_counter()
+    index = open_index(args.capture, args.rebuild)
+    elapsed = time.perf_counter() - begin
+    print('%d instructions, %d samples, index %.3f s' % (
+        len(index), index.num_samples, elapsed), file=sys.stderr)
+    if not args.window:
+        return
+
+    start, stop = (int(t * samplerate) for t in args.window)
+    begin = time.perf_counter()
+    records, last_start = decode_window(args.capture, index, start, stop)
+    elapsed = time.perf_counter() - begin
+    print_records(sys.stdout, records, samplerate, last_start)
+    first = index.instruction_at(int(records['ss'][0])) if len(records) else -1
+    print('%d instruction cycles from instruction %d, %.3f s' % (
+        len(records), first, elapsed), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
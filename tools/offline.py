@@ -0,0 +1,419 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Offline TI-5x decoder working on whole chunks of samples with NumPy.
+#
+# It follows the state machine of pd.Decoder.decode() exactly, but finds
+# the IDLE/PHI1 edges with vectorized operations and strobes EXT/IRG/IO of all
+# instruction cycles of a chunk at once:
+#
+#  - an instruction cycle starts at the first IDLE LO sample after the end
+#    of the previous s15 (or at the start of the capture),
+#  - s0 starts at the first PHI1 HI sample after that, s1..s15 at the
+#    following PHI1 rising edges, each S-state ends at the next PHI1 LO
+#    sample,
+#  - EXT/IRG/IO are read at the strobe points of the PHI1 lock and the
+#    majority of the values taken, see clock.py,
+#  - the words are emitted at the end of s14, with bit 15 still holding
+#    s15 of the previous instruction cycle.
+#
+# Only the samples of the current chunk plus the unfinished instruction
+# cycle at its end are kept in memory.
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from instructions import MNEMONICS, OPCLASSES, OpClass, format_io_word, format_word
+from clock import STROBES, drifted, majority
+from checkpoint import DecoderState, load_checkpoint, save_checkpoint
+from records import RECORD, RECORD_FIELDS
+from timing import CycleTiming, DurationTexts
+from segments import ModeSegments
+from .srfile import SrFile
+
+# Channel bits in a sample byte, see pd.Pin.
+IDLE, EXT, IRG, PHI1 = 0x01, 0x02, 0x04, 0x80
+
+# see pd.Mode
+CALCULATE, DISPLAY = range(2)
+MODE_NAMES = ('CALCULATE', 'DISPLAY')
+OPCLASS_NAMES = {value: name for name, value in vars(OpClass).items() if not name.startswith('_')}
+
+# One record per instruction cycle, the layout of records.RECORD. ss is the
+# start of the cycle (IDLE LO), es the end of s14, where the words and the
+# instruction are emitted.
+RECORD_DTYPE = np.dtype(list(zip(RECORD_FIELDS, ['<i8', '<i8', '<u2', '<u2', '<u8', 'u1', 'u1'])))
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+STATES = np.arange(16)
+
+# IO8..IO1 nibble of a sample byte (IO8 at bit 3 ... IO1 at bit 6)
+IO_NIBBLES = np.array([((v >> 3) & 1) << 3 | ((v >> 4) & 1) << 2 | ((v >> 5) & 1) << 1 | ((v >> 6) & 1)
+                       for v in range(256)], dtype=np.uint64)
+IO_SHIFTS = (4 * STATES).astype(np.uint64)
+IO_DIGIT15 = np.uint64(0xF << 60)
+
+
+class OfflineDecoder:
+    def __init__(self, max_carry=None):
+        # Samples not consumed yet and the absolute sample number of the
+        # first one.
+        self.carry = np.empty(0, dtype=np.uint8)
+        self.origin = 0
+        # Position (relative to carry) after which the next instruction
+        # cycle is searched, -1 at the start of the capture.
+        self.resume = -1
+        self.phi1_high = 0
+        self.ext_word = 0
+        self.irg_word = 0
+        self.io_word = 0
+        self._checkpoint = DecoderState()
+        # An instruction cycle waits for the clock as long as it takes, so
+        # without PHI1 the carry grows without limit. With max_carry set,
+        # such a cycle is given up once the carry would exceed max_carry
+        # samples and the next one is searched from the end of the buffer.
+        self.max_carry = max_carry
+        self.resyncs = 0
+
+    @classmethod
+    def from_state(cls, state):
+        # Continue after a checkpoint: feed the samples from
+        # max(state.sample, 0) on.
+        decoder = cls()
+        decoder.origin = max(state.sample, 0)
+        decoder.resume = state.sample - decoder.origin
+        decoder.phi1_high = state.phi1_high
+        decoder.ext_word = state.ext_word
+        decoder.irg_word = state.irg_word
+        decoder.io_word = state.io_word
+        decoder._checkpoint = state.snapshot()
+        return decoder
+
+    def checkpoint(self):
+        # DecoderState after the last instruction cycle returned by feed(),
+        # see checkpoint.py. The cycles returned by flush() are decoded
+        # again when resuming from it.
+        return self._checkpoint.snapshot()
+
+    def feed(self, samples):
+        if len(self.carry):
+            samples = np.concatenate((self.carry, samples))
+        return self._decode(samples, final=False)
+
+    def flush(self):
+        records = self._decode(self.carry, final=True)
+        self.carry = self.carry[:0]
+        return records
+
+    def _decode(self, buf, final):
+        # The carry is copied, as buf may be a view of the caller's buffer
+        # (tools/stream.py reuses one for every read).
+        n = len(buf)
+        if n < 2:
+            self.carry = buf.copy()
+            return np.empty(0, dtype=RECORD_DTYPE)
+
+        phi1 = (buf >> 7).view(np.int8)
+        idle = buf & IDLE
+
+        # PHI1 HI phases: starts and first LO sample after them. The last,
+        # unfinished phase is dropped.
+        edges = np.diff(phi1)
+        rises = np.flatnonzero(edges == 1) + 1
+        falls = np.flatnonzero(edges == -1) + 1
+        if phi1[0]:
+            rises = np.concatenate(([0], rises))
+        idx = np.searchsorted(falls, rises, 'right')
+        done = idx < len(falls)
+        hi_start = rises[done]
+        hi_end = falls[idx[done]]
+        nhi = len(hi_start)
+
+        idle_falls = np.flatnonzero(np.diff(idle.view(np.int8)) == -1) + 1
+
+        def cycle_starts(pos):
+            # For sync positions pos (end of s15), the start of the next
+            # instruction cycle and the index and start of its s0. -1 if not
+            # within this buffer.
+            x = np.minimum(pos + 1, n - 1)
+            i = np.minimum(np.searchsorted(idle_falls, x), len(idle_falls) - 1)
+            start = np.where(idle[x] == 0, x,
+                             idle_falls[i] if len(idle_falls) else n)
+            inside = (pos + 1 < n) & (start >= x) & (start < n - 1)
+            y = np.where(inside, start + 1, 0)
+            hi = phi1[y] == 1
+            k = np.where(hi, np.searchsorted(hi_start, y, 'right') - 1,
+                         np.searchsorted(hi_start, y))
+            inside &= (k >= 0) & (k < nhi)
+            if nhi:
+                kk = np.clip(k, 0, nhi - 1)
+                inside &= hi_end[kk] > y
+                s0 = np.where(hi, y, hi_start[kk])
+            else:
+                s0 = y
+            return (np.where(inside, start, -1), np.where(inside, k, -1),
+                    np.where(inside, s0, -1))
+
+        # Every PHI1 HI phase may turn out to be s15, so compute where s0 of
+        # the following instruction cycle would be for all of them and then
+        # just chain the cycles together.
+        next_k = cycle_starts(hi_end)[1].tolist()
+        k = int(cycle_starts(np.array([self.resume]))[1][0])
+        need = 15 if final else 16
+        cycles_k = []
+        while k >= 0 and k + need <= nhi:
+            cycles_k.append(k)
+            if k + 16 > nhi:
+                break
+            k = next_k[k + 15]
+
+        cycles_k = np.array(cycles_k, dtype=np.int64)
+        sync = np.concatenate(([self.resume], hi_end[cycles_k[:-1] + 15]))
+        cycles_start, _, cycles_s0 = cycle_starts(sync)
+        resume = hi_end[cycles_k[-1] + 15] if len(cycles_k) and not final else self.resume
+
+        records = self._read_cycles(buf, hi_start, hi_end, cycles_start,
+                                    cycles_k, cycles_s0)
+
+        # Keep the samples from the sync point on. If IDLE stays HI up to
+        # the end of the buffer, there is nothing worth keeping.
+        if idle[resume + 1:].all():
+            resume = n - 1
+        keep = max(int(resume), 0)
+        if self.max_carry and n - keep > self.max_carry:
+            resume = keep = n - 1
+            self.resyncs += 1
+        self.resume = int(resume) - keep
+        self.origin += keep
+        self.carry = buf[keep:].copy()
+        if not final:
+            self._save_state(records)
+        return records
+
+    def _save_state(self, records):
+        state = self._checkpoint
+        state.sample = self.origin + self.resume
+        state.phi1_high = self.phi1_high
+        state.ext_word = self.ext_word
+        state.irg_word = self.irg_word
+        state.io_word = self.io_word
+        if len(records):
+            state.instruction_start_sample = int(records['ss'][-1])
+            state.mode = int(records['mode'][-1])
+
+    def _read_cycles(self, buf, hi_start, hi_end, cycles_start, cycles_k,
+                     cycles_s0):
+        ncycles = len(cycles_k)
+        records = np.empty(ncycles, dtype=RECORD_DTYPE)
+        if not ncycles:
+            return records
+
+        hi = cycles_k[:, None] + STATES
+        hi = np.minimum(hi, len(hi_start) - 1)
+        starts = hi_start[hi]
+        starts[:, 0] = cycles_s0
+        ends = hi_end[hi]
+
+        # PHI1 lock of every S-state: s0 and s1 use the one the cycle before
+        # ended with, s2..s15 the length of s1, unless an S-state drifts off
+        # it. Only a few cycles re-lock, those are followed one by one.
+        lengths = ends - starts
+        high = np.empty_like(lengths)
+        high[:, 2:] = lengths[:, 1:2]
+        final = lengths[:, 1].copy()
+        for c in np.flatnonzero(drifted(lengths[:, 2:], high[:, 2:]).any(axis=1)).tolist():
+            h = int(final[c])
+            for k in range(2, 16):
+                high[c, k] = h
+                if drifted(int(lengths[c, k]), h):
+                    h = int(lengths[c, k])
+            final[c] = h
+        high[0, :2] = self.phi1_high
+        high[1:, :2] = final[:-1, None]
+        self.phi1_high = int(final[-1])
+
+        # Strobe points (clock.strobe_offsets()), those beyond the end of
+        # the PHI1 high phase repeat the one before, or the middle of the
+        # phase if there is none.
+        at = starts + (ends - starts) // 2
+        strobes = []
+        for i in range(1, STROBES + 1):
+            point = starts + np.maximum(high * i // (STROBES + 1), i)
+            at = np.where(point < ends, point, at)
+            strobes.append(buf[at])
+        values = majority(*strobes)
+
+        weights = np.left_shift(1, STATES)
+        ext = (((values & EXT) != 0) * weights).sum(axis=1)
+        irg = (((values & IRG) != 0) * weights).sum(axis=1)
+        # the nibbles do not overlap, so summing them is or-ing them
+        io = (IO_NIBBLES[values] << IO_SHIFTS).sum(axis=1, dtype=np.uint64)
+
+        # Bit 15 of an emitted word is s15 of the previous cycle.
+        prev_ext = np.concatenate(([self.ext_word], ext[:-1]))
+        prev_irg = np.concatenate(([self.irg_word], irg[:-1]))
+        records['ext'] = (ext & 0x7FFF) | (prev_ext & 0x8000)
+        records['irg'] = (irg & 0x7FFF) | (prev_irg & 0x8000)
+        prev_io = np.concatenate((np.array([self.io_word], dtype=np.uint64), io[:-1]))
+        records['io'] = (io & ~IO_DIGIT15) | (prev_io & IO_DIGIT15)
+        self.ext_word = int(ext[-1])
+        self.irg_word = int(irg[-1])
+        self.io_word = int(io[-1])
+
+        records['ss'] = cycles_start + self.origin
+        records['es'] = ends[:, 14] + self.origin
+        records['mode'] = np.where(values[:, 1] & IDLE, CALCULATE, DISPLAY)
+        records['opclass'] = np.frombuffer(OPCLASSES, dtype=np.uint8)[records['irg'] >> 3]
+        return records
+
+
+def decode_file(path, decoder=None):
+    # Yields one array of records per chunk of the capture. A decoder
+    # restored from a checkpoint continues where it stopped.
+    with SrFile(path) as capture:
+        decoder = decoder or OfflineDecoder()
+        for samples in capture.chunks_from(decoder.origin):
+            yield decoder.feed(samples)
+        yield decoder.flush()
+
+
+def load_trace(path):
+    # A binary trace (records of the decoder's OUTPUT_BINARY or of
+    # offline -b) as a read-only memory-mapped record array.
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r')
+
+
+def add_timing(timing, records):
+    # The cycle times of records into CycleTiming timing, the same as
+    # calling its cycle() for every record, with one add() per distinct
+    # cycle time and group.
+    if not len(records):
+        return
+    ss, mode, opclass = records['ss'], records['mode'], records['opclass']
+    if timing.last is not None:
+        ss = np.concatenate(([timing.last[0]], ss))
+        mode = np.concatenate(([timing.last[1]], mode))
+        opclass = np.concatenate(([timing.last[2]], opclass))
+    timing.last = (int(ss[-1]), int(mode[-1]), int(opclass[-1]))
+    durations = np.diff(ss)
+    starts = ss[:-1]
+    for groups, histograms in ((mode[:-1], timing.by_mode),
+                               (opclass[:-1], timing.by_opclass)):
+        keys = (groups.astype(np.int64) << 40) | durations
+        keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+        for key, i, count in zip(keys.tolist(), first.tolist(), counts.tolist()):
+            histograms[key >> 40].add(key & ((1 << 40) - 1), int(starts[i]), count)
+
+
+def add_segments(segments, records):
+    # The records into ModeSegments segments, one add() per run of cycles
+    # in the same mode.
+    if not len(records):
+        return
+    mode = records['mode']
+    starts = np.concatenate(([0], np.flatnonzero(mode[1:] != mode[:-1]) + 1))
+    ends = np.append(starts[1:], len(records))
+    for start, end, ss, es, run_mode in zip(
+            starts.tolist(), ends.tolist(), records['ss'][starts].tolist(),
+            records['es'][ends - 1].tolist(), mode[starts].tolist()):
+        segments.add(ss, es, run_mode, end - start)
+
+
+def print_records(out, records, samplerate, last_start):
+    # One line per instruction cycle, the cycle time being measured from
+    # last_start, the start of the previous cycle. Returns the start of the
+    # last cycle printed.
+    for ss, es, irg, ext, io, mode, opclass in records.tolist():
+        out.write('%d %d %8.3f us %s %s %s %s %s\n' % (
+            ss, es, (ss - last_start) * 1e6 / samplerate,
+            'DISP' if mode == DISPLAY else 'CALC',
+            format_word(ext), format_word(irg), format_io_word(io),
+            MNEMONICS[irg >> 3]))
+        last_start = ss
+    return last_start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Decode a TI-5x capture without libsigrokdecode.')
+    parser.add_argument('capture', help='sigrok session file (.sr)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only print the summary')
+    parser.add_argument('-b', '--binary', metavar='FILE',
+                        help='write the binary instruction trace to FILE')
+    parser.add_argument('-c', '--checkpoint', metavar='FILE',
+                        help='resume from checkpoint FILE if it exists, update it at the end')
+    parser.add_argument('-t', '--timing', action='store_true',
+                        help='print cycle time statistics per mode and instruction class')
+    parser.add_argument('-m', '--modes', action='store_true',
+                        help='print the CALCULATE/DISPLAY mode segments')
+    args = parser.parse_args(argv)
+
+    with SrFile(args.capture) as capture:
+        samplerate = capture.samplerate
+        num_samples = capture.num_samples
+
+    decoder = OfflineDecoder()
+    last_start = 0
+    if args.checkpoint:
+        state, _ = load_checkpoint(args.checkpoint, samplerate)
+        if state:
+            decoder = OfflineDecoder.from_state(state)
+            last_start = state.instruction_start_sample
+
+    out = sys.stdout
+    cycles = 0
+    decoded = 0
+    timing = CycleTiming(len(MODE_NAMES), len(OPCLASS_NAMES))
+    segments = ModeSegments()
+    binary = open(args.binary, 'wb') if args.binary else None
+    begin = time.perf_counter()
+    for records in decode_file(args.capture, decoder):
+        cycles += len(records)
+        if binary:
+            binary.write(records.tobytes())
+        decoded += int((records['opclass'] != 0).sum())
+        if args.timing:
+            add_timing(timing, records)
+        if args.modes:
+            add_segments(segments, records)
+        if not args.quiet:
+            last_start = print_records(out, records, samplerate, last_start)
+    elapsed = time.perf_counter() - begin
+    if args.timing:
+        text = DurationTexts(samplerate, lambda t: '%.3f us' % (t * 1e6))
+        for line in timing.report(text, MODE_NAMES, OPCLASS_NAMES):
+            print(line)
+    for ss, es, mode, count in segments.segments:
+        print('%d %d %.6f s %s %d cycles' % (ss, es, (es - ss) / samplerate,
+                                            MODE_NAMES[mode], count))
+    if binary:
+        binary.close()
+    if args.checkpoint:
+        save_checkpoint(args.checkpoint, decoder.checkpoint(), samplerate)
+    print('%d samples, %d instruction cycles, %d decoded, %.3f s (%.1f Msamples/s)'
+          % (num_samples, cycles, decoded, elapsed,
+             num_samples / elapsed / 1e6), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Parallel offline decoding of long captures.
+#
+# The capture is cut into shards, which are decoded by OfflineDecoder in a
+# pool of processes. A shard is decoded from the first IDLE falling edge
+# at or after its nominal start, as if the capture started there, and
+# continues a few instruction cycles into the next shard.
+#
+# Such a decoder may start in the middle of an instruction cycle, but it
+# gets in sync with the sequential decoder as soon as both see an
+# instruction cycle starting at the same sample: from there on they read
+# the same S-states and lock onto the PHI1 clock at the same s1. The shards
+# are merged at the first cycle both decoders agree on, taking that cycle
+# from the earlier shard (its bit 15 and the PHI1 lock for s0/s1 depend on
+# the cycle before). The
+# result is the same record stream as a sequential run, so cycle times
+# across shard boundaries are the same, too. Should the overlap be too
+# short to get in sync, the two shards are decoded again in one piece.
+#
+#   python3 -m tools.parallel -j 8 capture.sr > capture.txt
+
+import argparse
+import concurrent.futures
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+from .offline import IDLE, RECORD_DTYPE, OfflineDecoder, print_records
+from .srfile import SrFile
+
+# Shards are at least this long, shorter ones are not worth a process.
+MIN_SHARD_SAMPLES = 1 << 22
+
+
+def idle_fall(chunks, start):
+    # Sample number of the first IDLE falling edge at or after start and
+    # the chunks from there on, or None if there is none.
+    previous = None
+    pos = start
+    for samples in chunks:
+        idle = (samples & IDLE).view(np.int8)
+        if previous == IDLE and idle[0] == 0:
+            first = 0
+        else:
+            falls = np.flatnonzero(np.diff(idle) == -1)
+            if not len(falls):
+                previous = idle[-1]
+                pos += len(samples)
+                continue
+            first = int(falls[0]) + 1
+        return pos + first, itertools.chain([samples[first:]], chunks)
+    return None, None
+
+
+def decode_shard(path, start, stop, overlap):
+    # Records of the instruction cycles from start on, until overlap cycles
+    # (at least one) have started at or after stop.
+    with SrFile(path) as capture:
+        chunks = capture.chunks_from(start)
+        if start:
+            start, chunks = idle_fall(chunks, start)
+            if start is None or start >= stop:
+                return np.empty(0, dtype=RECORD_DTYPE)
+        decoder = OfflineDecoder()
+        decoder.origin = start
+        parts = []
+        beyond = 0
+        for samples in chunks:
+            records = decoder.feed(samples)
+            parts.append(records)
+            beyond += int((records['ss'] >= stop).sum())
+            if beyond >= max(overlap, 1):
+                break
+        else:
+            parts.append(decoder.flush())
+    return np.concatenate(parts)
+
+
+def shard_bounds(num_samples, shards):
+    bounds = np.linspace(0, num_samples, shards + 1).astype(np.int64).tolist()
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def merge_shards(path, shards, overlap):
+    # shards: (start, stop, records) in sample order
+    merged = []
+    for start, stop, records in shards:
+        if not len(records):
+            # no instruction cycles, the shard before covers them anyway
+            continue
+        while merged:
+            prev_start, prev_stop, prev = merged[-1]
+            common = np.intersect1d(prev['ss'], records['ss'], assume_unique=True)
+            if len(common):
+                ss = common[0]
+                merged[-1] = (prev_start, prev_stop, prev[prev['ss'] <= ss])
+                records = records[records['ss'] > ss]
+                break
+            # not in sync within the overlap: decode both shards in one
+            # and merge that with the shard before
+            merged.pop()
+            start = prev_start
+            records = decode_shard(path, start, stop, overlap)
+        merged.append((start, stop, records))
+    return np.concatenate([records for _, _, records in merged])
+
+
+def decode_parallel(path, jobs=None, shards=None, overlap=8):
+    # All records of a capture, the same as a sequential decode_file().
+    jobs = jobs or os.cpu_count()
+    with SrFile(path) as capture:
+        num_samples = capture.num_samples
+    if shards is None:
+        shards = min(4 * jobs, max(num_samples // MIN_SHARD_SAMPLES, 1))
+    bounds = shard_bounds(num_samples, shards)
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(decode_shard, path, start, stop, overlap)
+                   for start, stop in bounds]
+        results = [(start, stop, future.result())
+                   for (start, stop), future in zip(bounds, futures)]
+    return merge_shards(path, results, overlap)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Decode a TI-5x capture on several cores.')
+    parser.add_argument('capture', help='sigrok session file (.sr)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of processes (default: number of cores)')
+    parser.add_argument('-s', '--shards', type=int,
+                        help='number of shards (default: 4 per process)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only print the summary')
+    args = parser.parse_args(argv)
+
+    with SrFile(args.capture) as capture:
+        samplerate = capture.samplerate
+        num_samples = capture.num_samples
+
+    begin = time.perf_counter()
+    records = decode_parallel(args.capture, args.jobs, args.shards)
+    elapsed = time.perf_counter() - begin
+    if not args.quiet:
+        print_records(sys.stdout, records, samplerate, 0)
+    print('%d samples, %d instruction cycles, %d decoded, %.3f s (%.1f Msamples/s)'
+          % (num_samples, len(records), int((records['opclass'] != 0).sum()),
+             elapsed, num_samples / elapsed / 1e6), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Printed output of the PC-100A printer cradle, rebuilt from the printer
+# instructions of a trace.
+#
+# The printer has a line buffer of COLUMNS characters, each a 6 bit code
+# of the TI-59 print code table (the codes of Op 01..04, first digit * 8 +
+# second digit, see CHARSET). The buffer is kept as one packed integer of
+# 6 bits per column, column 0 in the most significant bits, and only
+# turned into text when a line is printed. The instructions act on it as
+# follows:
+#
+#   PRT_CLEAR     clear the buffer (all blanks)
+#   OUT PRT       shift one character in at the right, the two code digits
+#                 being IO digits 1 and 0 of the cycle
+#   PRT_STEP      shift one blank in at the right
+#   OUT PRT_FUNC  set the function code printed next to the line (trace
+#                 printing), IO digits 1 and 0
+#   PRT_PRINT     print the buffer
+#   PRT_FEED      advance the paper by one blank line
+#   PRT_WRITE     counted only
+#
+# The print codes are octal, so an IO digit 8..F cannot be part of one.
+# Such a code is counted (Printer.bad_codes) and the instruction ignored.
+#
+# Only the cycles of instruction class PRINTER are looked at, found with
+# one vectorized compare per batch of records, so the pass costs next to
+# nothing on top of decoding:
+#
+#   python3 -m tools.printer capture.sr
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from instructions import MNEMONICS, OpClass
+from .export import trace_batches
+
+COLUMNS = 20
+LINE_MASK = (1 << (6 * COLUMNS)) - 1
+BLANK = 0
+
+# print codes 00..77, codes whose character is not known shown as '▯'
+CHARSET = (' 0123456'
+           '789ABCDE'
+           '-FGHIJKL'
+           'MNOPQRST'
+           '.UVWXYZ+'
+           'x*√πe(),'
+           '↑%⇌/=\'▯▯'
+           '²?÷!▯ΔΠΣ')
+assert len(CHARSET) == 64
+
+CLEAR, LOAD, STEP, FUNCTION, PRINT, FEED, WRITE = range(1, 8)
+PRINTER_OPS = bytearray(8192)
+for word, text in enumerate(MNEMONICS):
+    PRINTER_OPS[word] = {'PRT_CLEAR': CLEAR, 'OUT PRT': LOAD, 'PRT_STEP': STEP,
+                         'OUT PRT_FUNC': FUNCTION, 'PRT_PRINT': PRINT,
+                         'PRT_FEED': FEED, 'PRT_WRITE': WRITE}.get(text, 0)
+
+
+def io_code(io):
+    # 6 bit print code of IO digits 1 (first) and 0 (second), None if
+    # either digit is not octal
+    first, second = (io >> 4) & 0xF, io & 0xF
+    if first > 7 or second > 7:
+        return None
+    return first << 3 | second
+
+
+def line_text(line):
+    return ''.join(CHARSET[(line >> (6 * (COLUMNS - 1 - column))) & 0x3F]
+                   for column in range(COLUMNS))
+
+
+class Printer:
+    def __init__(self):
+        self.line = BLANK
+        self.function = None
+        # (sample, text, function code or None) per line printed, text
+        # None for a paper feed
+        self.output = []
+        self.writes = 0
+        self.bad_codes = 0
+
+    def add(self, records):
+        # Printed lines of these records, also appended to self.output.
+        printed = len(self.output)
+        hits = np.flatnonzero(records['opclass'] == OpClass.PRINTER)
+        if not len(hits):
+            return []
+        ops = PRINTER_OPS
+        for ss, irg, io in zip(records['ss'][hits].tolist(), records['irg'][hits].tolist(),
+                               records['io'][hits].tolist()):
+            op = ops[irg >> 3]
+            if op == LOAD:
+                code = io_code(io)
+                if code is None:
+                    self.bad_codes += 1
+                else:
+                    self.line = ((self.line << 6) | code) & LINE_MASK
+            elif op == STEP:
+                self.line = (self.line << 6) & LINE_MASK
+            elif op == CLEAR:
+                self.line = BLANK
+                self.function = None
+            elif op == FUNCTION:
+                code = io_code(io)
+                if code is None:
+                    self.bad_codes += 1
+                else:
+                    self.function = code
+            elif op == PRINT:
+                self.output.append((ss, line_text(self.line), self.function))
+            elif op == FEED:
+                self.output.append((ss, None, None))
+            elif op == WRITE:
+                self.writes += 1
+        return self.output[printed:]
+
+
+def format_line(ss, text, function):
+    if text is None:
+        return '%d' % ss
+    if function is None:
+        return '%d |%s|' % (ss, text)
+    return '%d |%s| %02o' % (ss, text, function)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Rebuild the PC-100A printer output of a TI-5x capture.')
+    parser.add_argument('source', help='sigrok session file (.sr) or binary trace')
+    args = parser.parse_args(argv)
+
+    printer = Printer()
+    cycles = 0
+    begin = time.perf_counter()
+    for records in trace_batches(args.source):
+        for line in printer.add(records):
+            print(format_line(*line))
+        cycles += len(records)
+    elapsed = time.perf_counter() - begin
+    print('%d instruction cycles, %d lines printed, %d paper feeds, %d bad print codes, '
+          '%.3f s' % (
+              cycles, sum(1 for _, text, _ in printer.output if text is not None),
+              sum(1 for _, text, _ in printer.output if text is None), printer.bad_codes,
+              elapsed),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
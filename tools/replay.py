@@ -0,0 +1,266 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Replay of decoded instruction records on a last-writer model of the
+# TMC0501 registers.
+#
+# The effect of every instruction word is compiled once, from its mnemonic
+# (instructions.MNEMONICS), into a single micro-operation on a state
+# vector of integers:
+#
+#   FA, FB    flag registers, 16 bits
+#   KR, SR    key and subroutine register, 16 bits
+#   R5        4 bit register
+#   IDLE      set by SET IDLE, cleared by CLR IDLE
+#   A..E      the 16 digit registers
+#
+# The digits of A..E depend on the masks, constants and IO bus inputs of
+# the arithmetic instructions, which the instruction table does not
+# describe. For these registers the model holds the number of the last
+# instruction that wrote them (-1 if none), following XCH. ALU and mask
+# instructions write the destination given by bits 2..0 of the word. For
+# destination IO, the instruction drives the IO bus and no register changes.
+#
+# This is not a replay of the processor state. The digits of A..E are not
+# known, and neither is the COND flag the tests and the arithmetic
+# instructions set, so the TST instructions are replayed as no-ops and the
+# model cannot tell which way a branch went. Only the flag registers, KR,
+# SR, R5 and IDLE hold values; A..E tell which instruction wrote them last.
+#
+# BUSY is not modelled: how the card reader and printer set it is not on
+# the bus, so TST BUSY and WAIT BUSY are replayed as no-ops.
+#
+# The IO word of every instruction is kept with the replay. io_activity()
+# counts how often the IO bus is non-zero in the cycle of a MASK or ALU
+# instruction and in the cycle after it, split by IO and register
+# destination, against all other instructions, to see whether the IO
+# activity after mask operations noted in the readme is real (--io).
+#
+# replay() runs over the records in blocks and keeps a snapshot of the
+# state at the start of every block, so state_at() only has to replay a
+# part of a block.
+#
+#   python3 -m tools.replay capture.sr -i 1000 -i 20000
+#   python3 -m tools.replay capture.sr --io
+
+import argparse
+import re
+import sys
+import time
+
+import numpy as np
+
+from instructions import MNEMONICS, OPCLASSES, OpClass
+from .offline import decode_file
+
+A, B, C, D, E, FA, FB, KR, SR, R5, IDLE = range(11)
+REGISTER_NAMES = ('A', 'B', 'C', 'D', 'E', 'FA', 'FB', 'KR', 'SR', 'R5', 'IDLE')
+REGISTERS = {name: reg for reg, name in enumerate(REGISTER_NAMES)}
+WIDTHS = {FA: 0xFFFF, FB: 0xFFFF, KR: 0xFFFF, SR: 0xFFFF, R5: 0xF, IDLE: 1}
+
+# micro-operations (kind, a, b, mask)
+NOP, SET, CLR, INV, MOVE, SWAP, INC, LOAD, EXT, WRITE = range(10)
+
+# ALU destination (bits 2..0): registers written, XCH swaps the two
+ALU_DESTS = {0: (WRITE, A), 1: None, 2: (SWAP, A, B), 3: (WRITE, B),
+             4: (WRITE, C), 5: (SWAP, C, D), 6: (WRITE, D), 7: (SWAP, A, E)}
+
+SNAPSHOT_EVERY = 4096
+
+
+def compile_effect(word):
+    text = MNEMONICS[word]
+    opclass = OPCLASSES[word]
+    if opclass in (OpClass.ALU, OpClass.MASK):
+        dest = ALU_DESTS[word & 7]
+        if dest is None:
+            return (NOP, 0, 0, 0)
+        if dest[0] == WRITE:
+            return (WRITE, dest[1], 0, 0)
+        return (SWAP, dest[1], dest[2], -1)
+    m = re.match(r'(SET|CLR|INV) (FA|FB|KR)\((\d+)\)$', text)
+    if m:
+        kind = {'SET': SET, 'CLR': CLR, 'INV': INV}[m.group(1)]
+        return (kind, REGISTERS[m.group(2)], 0, 1 << int(m.group(3)))
+    m = re.match(r'(XCH|MOV) (FA|FB)\((\d+)\),(FA|FB)\(\d+\)$', text)
+    if m:
+        kind = SWAP if m.group(1) == 'XCH' else MOVE
+        return (kind, REGISTERS[m.group(2)], REGISTERS[m.group(4)], 1 << int(m.group(3)))
+    m = re.match(r'MOV R5,#(\d+)$', text)
+    if m:
+        return (LOAD, R5, int(m.group(1)), 0xF)
+    m = re.match(r'(MOV|XCH) (FA|FB|KR|R5),(FA|FB|KR|SR|R5)$', text)
+    if m:
+        a, b = REGISTERS[m.group(2)], REGISTERS[m.group(3)]
+        mask = WIDTHS[a] & WIDTHS[b]
+        return ((SWAP if m.group(1) == 'XCH' else MOVE), a, b, mask)
+    if text in ('CLR FA', 'CLR FB'):
+        return (CLR, REGISTERS[text[4:]], 0, 0xFFFF)
+    if text == 'SET IDLE':
+        return (SET, IDLE, 0, 1)
+    if text == 'CLR IDLE':
+        return (CLR, IDLE, 0, 1)
+    if text == 'INK KR':
+        return (INC, KR, 0, 0xFFFF)
+    if text == 'MOV KR,EXT':
+        return (EXT, KR, 0, 0xFFFF)
+    return (NOP, 0, 0, 0)
+
+
+EFFECTS = [compile_effect(word) for word in range(8192)]
+
+
+def initial_state():
+    state = len(REGISTER_NAMES) * [0]
+    for reg in (A, B, C, D, E):
+        state[reg] = -1
+    return state
+
+
+def execute(state, words, exts, start, stop):
+    # Apply instructions start..stop-1 to the state list in place.
+    effects = EFFECTS
+    s = state
+    for i in range(start, stop):
+        kind, a, b, mask = effects[words[i]]
+        if kind == NOP:
+            continue
+        if kind == SET:
+            s[a] |= mask
+        elif kind == CLR:
+            s[a] &= ~mask
+        elif kind == WRITE:
+            s[a] = i
+        elif kind == INV:
+            s[a] ^= mask
+        elif kind == MOVE:
+            s[a] = (s[a] & ~mask) | (s[b] & mask)
+        elif kind == SWAP:
+            x, y = s[a], s[b]
+            s[a] = (x & ~mask) | (y & mask)
+            s[b] = (y & ~mask) | (x & mask)
+        elif kind == INC:
+            s[a] = (s[a] + 1) & mask
+        elif kind == LOAD:
+            s[a] = b
+        elif kind == EXT:
+            s[a] = exts[i] & mask
+
+
+class ReplayEngine:
+    def __init__(self, records, snapshot_every=SNAPSHOT_EVERY):
+        self.words = (records['irg'] >> 3).tolist()
+        self.exts = records['ext'].tolist()
+        self.ios = np.array(records['io'])
+        self.opclasses = np.array(records['opclass'])
+        self.dests = np.array(records['irg'] >> 3) & 7
+        self.snapshot_every = snapshot_every
+        self.snapshots = None
+        self.state = None
+
+    def __len__(self):
+        return len(self.words)
+
+    def replay(self):
+        # Final state; snapshots[k] is the state before instruction
+        # k * snapshot_every.
+        n = len(self.words)
+        every = self.snapshot_every
+        state = initial_state()
+        snapshots = np.empty(((n + every - 1) // every, len(state)), dtype=np.int64)
+        for k, start in enumerate(range(0, n, every)):
+            snapshots[k] = state
+            execute(state, self.words, self.exts, start, min(start + every, n))
+        self.snapshots = snapshots
+        self.state = state
+        return state
+
+    def state_at(self, instruction):
+        # State after instruction number 'instruction'.
+        if not 0 <= instruction < len(self.words):
+            raise IndexError('instruction %d out of range 0..%d' % (instruction, len(self.words) - 1))
+        if self.snapshots is None:
+            self.replay()
+        k = instruction // self.snapshot_every
+        state = self.snapshots[k].tolist()
+        execute(state, self.words, self.exts, k * self.snapshot_every, instruction + 1)
+        return state
+
+    def io_activity(self):
+        # (instructions, name, count, IO non-zero in their cycle, IO
+        # non-zero in the next cycle) for MASK and ALU instructions with IO
+        # and with register destination, and for all other instructions.
+        busy = self.ios != 0
+        after = np.append(busy[1:], False)
+        arithmetic = (self.opclasses == OpClass.MASK) | (self.opclasses == OpClass.ALU)
+        to_io = self.dests == 1
+        groups = [('MASK, IO destination', (self.opclasses == OpClass.MASK) & to_io),
+                  ('MASK, register destination', (self.opclasses == OpClass.MASK) & ~to_io),
+                  ('ALU, IO destination', (self.opclasses == OpClass.ALU) & to_io),
+                  ('ALU, register destination', (self.opclasses == OpClass.ALU) & ~to_io),
+                  ('other instructions', ~arithmetic)]
+        return [(name, int(group.sum()), int((busy & group).sum()), int((after & group).sum()))
+                for name, group in groups]
+
+
+def format_state(state):
+    parts = []
+    for reg, name in enumerate(REGISTER_NAMES):
+        if reg <= E:
+            parts.append('%s@%s' % (name, state[reg] if state[reg] >= 0 else '-'))
+        elif WIDTHS[reg] == 0xFFFF:
+            parts.append('%s=%04X' % (name, state[reg]))
+        else:
+            parts.append('%s=%X' % (name, state[reg]))
+    return ' '.join(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Replay a TI-5x capture on a last-writer model of the processor registers.')
+    parser.add_argument('capture', help='sigrok session file (.sr)')
+    parser.add_argument('-i', '--instruction', type=int, action='append', default=[],
+                        help='print the state after this instruction number')
+    parser.add_argument('--io', action='store_true',
+                        help='count non-zero IO words in and after MASK/ALU instructions')
+    args = parser.parse_args(argv)
+
+    records = np.concatenate(list(decode_file(args.capture)))
+    engine = ReplayEngine(records)
+    begin = time.perf_counter()
+    state = engine.replay()
+    elapsed = time.perf_counter() - begin
+    for instruction in args.instruction:
+        try:
+            text = format_state(engine.state_at(instruction))
+        except IndexError as e:
+            parser.error(str(e))
+        print('%d %d %s %s' % (instruction, records['ss'][instruction],
+                               MNEMONICS[engine.words[instruction]], text))
+    print('final', format_state(state))
+    if args.io:
+        print('%-28s %9s %9s %9s' % ('instructions', 'count', 'IO in', 'IO after'))
+        for name, count, during, after in engine.io_activity():
+            print('%-28s %9d %9d %9d' % (name, count, during, after))
+    print('%d instructions, %.3f s (%.2f M instructions/s)' % (
+        len(engine), elapsed, len(engine) / elapsed / 1e6), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Stand-in for the 'sigrokdecode' module, to run pd.Decoder outside of
+# libsigrokdecode.
+#
+# install() registers this module as 'sigrokdecode' and loads the decoder
+# package. Replay then feeds a decoder instance with samples from an
+# iterator of uint8 chunks, implementing the wait() conditions of the
+# libsigrokdecode API version 3 ('l', 'h', 'r', 'f', 'e' and 'skip'), and
+# collects everything the decoder put()s.
+
+import bisect
+import importlib.util
+import os
+import sys
+
+import numpy as np
+
+OUTPUT_ANN, OUTPUT_PYTHON, OUTPUT_BINARY, OUTPUT_LOGIC, OUTPUT_META = range(5)
+SRD_CONF_SAMPLERATE = 10000
+
+
+class Decoder:
+    pass
+
+
+def install(name='ti5x'):
+    # Load the decoder directory as package 'name', with this module
+    # standing in for sigrokdecode.
+    if name in sys.modules:
+        return sys.modules[name]
+    sys.modules['sigrokdecode'] = sys.modules[__name__]
+    decoder_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(decoder_dir, '__init__.py'),
+        submodule_search_locations=[decoder_dir])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[name] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+class Replay:
+    def __init__(self, decoder, chunks, samplerate, options=None):
+        self.decoder = decoder
+        self.chunks = iter(chunks)
+        # buf[0] is the sample before the current chunk, so that edges on
+        # the first sample of a chunk are seen. buf[i] is sample base + i.
+        self.buf = None
+        self.base = -1
+        self.levels = {}
+        self.edges = {}
+        self.cur = -1
+        self.outputs = []
+        self.annotations = 0
+        self.annotation_counts = {}
+        self.puts = []
+        self.keep = True
+        self.wait_calls = 0
+
+        decoder.register = self.register
+        decoder.put = self.put
+        decoder.wait = self.wait
+        decoder.samplenum = 0
+        decoder.matched = ()
+        decoder.options = {option['id']: option['default']
+                           for option in getattr(decoder, 'options', ())}
+        decoder.options.update(options or {})
+        decoder.reset()
+        decoder.metadata(SRD_CONF_SAMPLERATE, samplerate)
+
+    def register(self, output_type, meta=None, proto_id=None):
+        self.outputs.append((output_type, meta))
+        return len(self.outputs) - 1
+
+    def put(self, ss, es, output_id, data):
+        if self.outputs[output_id][0] == OUTPUT_ANN:
+            self.annotations += 1
+            self.annotation_counts[data[0]] = self.annotation_counts.get(data[0], 0) + 1
+        if self.keep:
+            self.puts.append((ss, es, self.outputs[output_id][0], data))
+
+    def run(self):
+        self.decoder.start()
+        try:
+            self.decoder.decode()
+        except EOFError:
+            pass
+        return self
+
+    def _next_chunk(self):
+        chunk = next(self.chunks, None)
+        while chunk is not None and not len(chunk):
+            chunk = next(self.chunks, None)
+        if chunk is None:
+            return False
+        if self.buf is None:
+            previous = chunk[:1]
+        else:
+            previous = self.buf[-1:]
+            self.base += len(self.buf) - 1
+        self.buf = np.concatenate((previous, chunk))
+        self.levels = {}
+        self.edges = {}
+        return True
+
+    def _channel(self, pin):
+        # Level of every sample and the positions where it differs from the
+        # previous sample, as plain Python objects for fast scalar access.
+        if pin not in self.levels:
+            level = (self.buf >> pin) & 1
+            self.levels[pin] = level.tobytes()
+            self.edges[pin] = (np.flatnonzero(np.diff(level.view(np.int8))) + 1).tolist()
+        return self.levels[pin], self.edges[pin]
+
+    def _find(self, pin, cond, start):
+        # First position >= start in buf matching the condition, or None.
+        level, edges = self._channel(pin)
+        if start >= len(level):
+            return None
+        i = bisect.bisect_left(edges, start)
+        if cond in 'lh':
+            if level[start] == (cond == 'h'):
+                return start
+            return edges[i] if i < len(edges) else None
+        while i < len(edges):
+            pos = edges[i]
+            if cond == 'e' or level[pos] == (cond == 'r'):
+                return pos
+            i += 1
+        return None
+
+    def _match(self, condition, start):
+        # Condition dicts AND their terms: find a position matching all of
+        # them by advancing to the latest candidate until they agree.
+        if len(condition) == 1:
+            (pin, cond), = condition.items()
+            return self._find(pin, cond, start)
+        pos = start
+        while True:
+            found = [self._find(pin, cond, pos) for pin, cond in condition.items()]
+            if None in found:
+                return None
+            if min(found) == max(found):
+                return found[0]
+            pos = max(found)
+
+    def wait(self, conditions=None):
+        self.wait_calls += 1
+        if conditions is None:
+            conditions = []
+        elif isinstance(conditions, dict):
+            conditions = [conditions]
+        # No conditions: return the next sample (the first one on the
+        # first call).
+        conditions = [c for c in conditions if c] or [{'skip': 1}]
+
+        if self.buf is None and not self._next_chunk():
+            raise EOFError()
+        while True:
+            start = max(self.cur + 1 - self.base, 1)
+            found = []
+            for condition in conditions:
+                if 'skip' in condition:
+                    pos = self.cur + condition['skip'] - self.base
+                    found.append(pos if pos < len(self.buf) else None)
+                else:
+                    found.append(self._match(condition, start))
+            hits = [pos for pos in found if pos is not None]
+            if hits:
+                pos = min(hits)
+                break
+            if not self._next_chunk():
+                raise EOFError()
+
+        self.cur = self.base + pos
+        sample = self.buf[pos].item()
+        self.decoder.samplenum = self.cur
+        self.decoder.matched = tuple(p == pos for p in found)
+        return tuple((sample >> pin) & 1 for pin in range(8))
@@ -0,0 +1,147 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+# Reader and writer for sigrok session files (.sr).
+#
+# A session file is a zip archive holding a 'metadata' ini file and the
+# logic samples, split into chunks 'logic-1-1', 'logic-1-2', ... of
+# 'unitsize' bytes per sample. The TI-5x signals are expected on the first
+# eight channels, in the order of pd.Pin (IDLE, EXT, IRG, IO8, IO4, IO2,
+# IO1, PHI1), so only the lowest byte of every sample is kept.
+
+import configparser
+import io
+import zipfile
+
+import numpy as np
+
+PROBES = ('IDLE', 'EXT', 'IRG', 'IO8', 'IO4', 'IO2', 'IO1', 'PHI')
+CHUNK_BYTES = 4 << 20
+UNITS = {'Hz': 1, 'kHz': 1000, 'MHz': 1000 * 1000, 'GHz': 1000 * 1000 * 1000}
+
+
+def parse_samplerate(text):
+    value, unit = text.split()
+    return int(float(value) * UNITS[unit])
+
+
+def format_samplerate(rate):
+    for unit in ('GHz', 'MHz', 'kHz'):
+        if rate >= UNITS[unit] and rate % UNITS[unit] == 0:
+            return '%d %s' % (rate // UNITS[unit], unit)
+    return '%d Hz' % rate
+
+
+def write_sr(path, chunks, samplerate, compresslevel=1):
+    # Write uint8 sample arrays (one byte per sample, the channels of
+    # PROBES) as a session file, in chunks of CHUNK_BYTES like sigrok
+    # does. Returns the number of samples written.
+    metadata = configparser.ConfigParser()
+    metadata.optionxform = str
+    metadata['global'] = {'sigrok version': '0.5.0'}
+    device = {'capturefile': 'logic-1', 'total probes': str(len(PROBES)),
+              'samplerate': format_samplerate(samplerate), 'total analog': '0'}
+    device.update(('probe%d' % (i + 1), name) for i, name in enumerate(PROBES))
+    device['unitsize'] = '1'
+    metadata['device 1'] = device
+    text = io.StringIO()
+    metadata.write(text)
+
+    total = 0
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED,
+                         compresslevel=compresslevel) as z:
+        z.writestr('version', '2')
+        z.writestr('metadata', text.getvalue())
+        pending = []
+        size = 0
+        number = 0
+        for chunk in chunks:
+            pending.append(chunk)
+            size += len(chunk)
+            total += len(chunk)
+            while size >= CHUNK_BYTES:
+                data = np.concatenate(pending)
+                number += 1
+                z.writestr('logic-1-%d' % number, data[:CHUNK_BYTES].tobytes())
+                pending = [data[CHUNK_BYTES:]]
+                size = len(pending[0])
+        if size:
+            number += 1
+            z.writestr('logic-1-%d' % number, np.concatenate(pending).tobytes())
+    return total
+
+
+class SrFile:
+    def __init__(self, path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path)
+        metadata = configparser.ConfigParser()
+        metadata.read_string(self.zip.read('metadata').decode())
+        device = metadata['device 1']
+        self.samplerate = parse_samplerate(device['samplerate'])
+        self.unitsize = int(device['unitsize'])
+        self.capturefile = device['capturefile']
+        self.probes = [device[key] for key in device if key.startswith('probe')]
+        prefix = self.capturefile + '-'
+        self.chunk_names = sorted(
+            (name for name in self.zip.namelist() if name.startswith(prefix)),
+            key=lambda name: int(name[len(prefix):]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.zip.close()
+
+    @property
+    def num_samples(self):
+        return sum(self.zip.getinfo(name).file_size
+                   for name in self.chunk_names) // self.unitsize
+
+    def read_chunk(self, name):
+        raw = np.frombuffer(self.zip.read(name), dtype=np.uint8)
+        return np.ascontiguousarray(raw[::self.unitsize])
+
+    def chunks(self):
+        # One chunk in memory at a time.
+        for name in self.chunk_names:
+            yield self.read_chunk(name)
+
+    def chunk_starts(self):
+        # Sample number of the first sample of every chunk, plus the total.
+        starts = [0]
+        for name in self.chunk_names:
+            starts.append(starts[-1] + self.zip.getinfo(name).file_size // self.unitsize)
+        return starts
+
+    def chunks_from(self, start):
+        # Like chunks(), beginning at sample number start. Chunks before it
+        # are not decompressed.
+        starts = self.chunk_starts()
+        for i, name in enumerate(self.chunk_names):
+            if starts[i + 1] <= start:
+                continue
+            chunk = self.read_chunk(name)
+            if starts[i] < start:
+                chunk = chunk[start - starts[i]:]
+            yield chunk
@@ -0,0 +1,169 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Live decoding of a sample stream.
+#
+# 'decode' reads raw samples from stdin, as written by
+# 'sigrok-cli -O binary' (unitsize bytes per sample, the TI-5x signals on
+# the first eight channels), into a fixed size buffer and feeds them to
+# OfflineDecoder. Instruction cycles are printed as soon as they are
+# complete. Memory stays bounded: the buffer, plus the samples of one
+# unfinished instruction cycle, and without a clock at most MAX_CARRY
+# samples.
+#
+# Every --report seconds a status line goes to stderr: the samples
+# received, the decode lag (time from reading a buffer to having printed
+# its instruction cycles, worst case since the last report) and, for a
+# real-time source, how far the decoder is behind the wall clock.
+#
+# 'play' writes the samples of a .sr file to stdout at its samplerate (or
+# a multiple of it), to try this without hardware:
+#
+#   python3 -m tools.stream play capture.sr | python3 -m tools.stream decode -r 5MHz
+#   sigrok-cli -d fx2lafw -c samplerate=5m --continuous -O binary | python3 -m tools.stream decode -r 5MHz
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from .offline import OfflineDecoder, print_records
+from .srfile import SrFile
+
+BUFFER_SAMPLES = 1 << 18
+MAX_CARRY = 1 << 24
+UNITS = {'': 1, 'k': 1000, 'm': 1000 * 1000, 'g': 1000 * 1000 * 1000}
+
+
+def parse_rate(text):
+    # '5000000', '5m', '5MHz', '5 MHz'
+    text = text.strip().lower().replace(' ', '')
+    if text.endswith('hz'):
+        text = text[:-2]
+    unit = text[-1:] if text[-1:] in UNITS else ''
+    return int(float(text[:len(text) - len(unit)]) * UNITS[unit])
+
+
+def read_full(stream, view):
+    # Fill view unless the stream ends, returns the number of bytes read.
+    got = 0
+    while got < len(view):
+        n = stream.readinto(view[got:])
+        if not n:
+            break
+        got += n
+    return got
+
+
+def decode(args):
+    samplerate = parse_rate(args.samplerate)
+    unitsize = args.unitsize
+    raw = bytearray(args.buffer * unitsize)
+    view = memoryview(raw)
+    units = np.frombuffer(raw, dtype=np.uint8)
+    samples = np.empty(args.buffer, dtype=np.uint8)
+    decoder = OfflineDecoder(max_carry=MAX_CARRY)
+    stdin = sys.stdin.buffer
+    out = sys.stdout
+
+    received = 0
+    cycles = 0
+    last_start = 0
+    lag = 0.0
+    begin = time.perf_counter()
+    next_report = begin + args.report
+    while True:
+        got = read_full(stdin, view)
+        n = got // unitsize
+        arrived = time.perf_counter()
+        if n:
+            np.copyto(samples[:n], units[:n * unitsize:unitsize])
+            records = decoder.feed(samples[:n])
+            received += n
+        else:
+            records = decoder.flush()
+        cycles += len(records)
+        if not args.quiet and len(records):
+            last_start = print_records(out, records, samplerate, last_start)
+            out.flush()
+        now = time.perf_counter()
+        lag = max(lag, now - arrived)
+        if now >= next_report or not n:
+            behind = (now - begin) - received / samplerate
+            print('%.1f s: %d samples, %d instruction cycles, decode lag %.1f ms, '
+                  '%.3f s behind real time, %d samples pending, %d resyncs' % (
+                      now - begin, received, cycles, lag * 1000, max(behind, 0),
+                      len(decoder.carry), decoder.resyncs), file=sys.stderr)
+            lag = 0.0
+            next_report = now + args.report
+        if got < len(raw):
+            if n:
+                continue
+            break
+
+
+def play(args):
+    with SrFile(args.capture) as capture:
+        rate = capture.samplerate * args.speed
+        out = sys.stdout.buffer
+        begin = time.perf_counter()
+        sent = 0
+        for chunk in capture.chunks():
+            for pos in range(0, len(chunk), args.buffer):
+                piece = chunk[pos:pos + args.buffer]
+                if rate:
+                    delay = begin + (sent + len(piece)) / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                try:
+                    out.write(piece.tobytes())
+                except BrokenPipeError:
+                    return
+                sent += len(piece)
+        out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode a live TI-5x sample stream.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('decode', help='decode raw samples from stdin')
+    p.add_argument('-r', '--samplerate', required=True, help='e.g. 5MHz')
+    p.add_argument('-u', '--unitsize', type=int, default=1,
+                   help='bytes per sample (default: 1)')
+    p.add_argument('-b', '--buffer', type=int, default=BUFFER_SAMPLES,
+                   help='samples per read (default: %d)' % BUFFER_SAMPLES)
+    p.add_argument('-t', '--report', type=float, default=1.0,
+                   help='seconds between status lines (default: 1)')
+    p.add_argument('-q', '--quiet', action='store_true',
+                   help='only print the status lines')
+    p.set_defaults(run=decode)
+    p = commands.add_parser('play', help='write the samples of a capture to stdout')
+    p.add_argument('capture', help='sigrok session file (.sr)')
+    p.add_argument('-s', '--speed', type=float, default=1.0,
+                   help='multiple of the samplerate, 0 for as fast as possible')
+    p.add_argument('-b', '--buffer', type=int, default=1 << 16,
+                   help='samples per write (default: 65536)')
+    p.set_defaults(run=play)
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
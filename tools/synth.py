@@ -0,0 +1,362 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 20xxx
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Synthetic TI-5x bus waveforms.
+#
+# Synthesizer turns instruction cycles (IRG, EXT and IO word, mode) into
+# samples with the channel layout of pd.Pin, as the decoder expects them:
+#
+#  - every S-state is a slot of one PHI1 period: PHI1 LO, then HI for the
+#    duty cycle of the mode (CLOCKS, the clock of the TI-59 or of the
+#    TI-58C example, which has the same clock in both modes),
+#  - EXT/IRG/IO carry bit (digit) N of the words in the slot of sN, IDLE
+#    is LO in the slot of s0 in CALCULATE mode and HI only in the slot of
+#    s15 in DISPLAY mode, all of them changing DATA_DELAY samples after
+#    the start of a slot,
+#  - as the decoder reads them, bit 15 of the IRG/EXT words and digit 15
+#    of the IO word of a cycle are sent in s15 of the cycle before.
+#
+# Jitter moves the PHI1 rising edges by up to that many samples, glitches
+# are single-sample spikes on the data lines (EXT, IRG, IO), on average
+# that many per sample. Cycles are synthesized in batches with NumPy,
+# together with the records the decoder should produce for them (see
+# records.py), so a decoder can be checked against them.
+#
+#   python3 -m tools.synth -n 100000 -w all -o synth.sr
+#   python3 -m tools.synth -n 1000000 -r 5MHz --jitter 2 --glitches 1e-4 --decode offline
+#   python3 -m tools.synth -n 100000 -r 1MHz -c ti58c --decode pd
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from instructions import OPCLASSES
+from .offline import IDLE, PHI1, RECORD_DTYPE, OfflineDecoder
+from .srfile import SrFile, write_sr
+from .stream import parse_rate
+
+# S-state period in seconds and PHI1 duty cycle, per mode (see pd.Mode),
+# as measured on the example captures
+CLOCKS = {
+    'ti59': ((4.35e-6, 0.76), (17.4e-6, 0.93)),
+    'ti58c': ((5.29e-6, 0.76), (5.29e-6, 0.76)),
+}
+DATA_DELAY = 1
+BATCH_CYCLES = 4096
+
+STATES = np.arange(16)
+# IO8..IO1 nibble -> sample bits (IO8 at bit 3 ... IO1 at bit 6)
+IO_BITS = np.array([((n >> 3) & 1) << 3 | ((n >> 2) & 1) << 4 | ((n >> 1) & 1) << 5 | (n & 1) << 6
+                    for n in range(16)], dtype=np.uint8)
+DATA_LINES = np.array([0x02, 0x04, 0x08, 0x10, 0x20, 0x40], dtype=np.uint8)
+OPCLASS_TABLE = np.frombuffer(OPCLASSES, dtype=np.uint8)
+
+
+class Synthesizer:
+    def __init__(self, samplerate, jitter=0, glitches=0.0, seed=0, clock='ti59'):
+        self.samplerate = samplerate
+        self.jitter = jitter
+        self.glitches = glitches
+        self.rng = np.random.default_rng(seed)
+        # PHI1 period (samples, float) and HI length per mode. PHI1 LO must
+        # last DATA_DELAY samples at least, at the limit the data lines
+        # change with the PHI1 rising edge.
+        self.periods = np.array([period * samplerate for period, _ in CLOCKS[clock]])
+        self.highs = np.array([max(int(round(period * samplerate * duty)), 1)
+                               for period, duty in CLOCKS[clock]])
+        if (np.floor(self.periods) - self.highs < DATA_DELAY).any():
+            raise ValueError('samplerate %g too low for the %s clock' % (samplerate, clock))
+        # time of the next slot (float) and its first sample
+        self.time = 0.0
+        self.position = 0
+        # data byte of the last slot, the first one starts with IDLE HI
+        self.last_byte = IDLE
+        # last cycle, held back until the first word of the next is known
+        self.pending = None
+        self.first = True
+
+    def cycles(self, irg, ext, io, mode):
+        # Samples and expected records of the given cycles (arrays), the
+        # last one is held back until the next call or finish().
+        cycles = np.empty(len(irg), dtype=RECORD_DTYPE)
+        cycles['irg'] = irg
+        cycles['ext'] = ext
+        cycles['io'] = io
+        cycles['mode'] = mode
+        if self.pending is not None:
+            cycles = np.concatenate((self.pending, cycles))
+        if not len(cycles):
+            return np.empty(0, dtype=np.uint8), cycles
+        self.pending = cycles[-1:].copy()
+        return self._synthesize(cycles[:-1], cycles[-1:])
+
+    def finish(self):
+        # Samples and record of the held back cycle, plus one idle slot.
+        samples, records = np.empty(0, dtype=np.uint8), self.pending
+        if self.pending is not None:
+            last = np.zeros(1, dtype=RECORD_DTYPE)
+            samples, records = self._synthesize(self.pending, last)
+            self.pending = None
+        tail = np.full(int(self.periods[0]), self.last_byte & IDLE, dtype=np.uint8)
+        tail[DATA_DELAY:] = IDLE
+        self.position += len(tail)
+        return np.concatenate((samples, tail)), records
+
+    def _synthesize(self, cycles, following):
+        n = len(cycles)
+        if not n:
+            return np.empty(0, dtype=np.uint8), cycles
+        mode = cycles['mode'].astype(np.intp)
+
+        # data byte of every slot
+        irg = cycles['irg'].astype(np.int64)
+        ext = cycles['ext'].astype(np.int64)
+        io = cycles['io']
+        next_irg = np.concatenate((irg[1:], following['irg'].astype(np.int64)))
+        next_ext = np.concatenate((ext[1:], following['ext'].astype(np.int64)))
+        next_io = np.concatenate((io[1:], following['io']))
+        irg = (irg & 0x7FFF) | (next_irg & 0x8000)
+        ext = (ext & 0x7FFF) | (next_ext & 0x8000)
+        digit15 = np.uint64(0xF << 60)
+        io = (io & ~digit15) | (next_io & digit15)
+        data = (((ext[:, None] >> STATES) & 1) << 1 | ((irg[:, None] >> STATES) & 1) << 2).astype(np.uint8)
+        data |= IO_BITS[((io[:, None] >> (4 * STATES).astype(np.uint64)) & np.uint64(0xF)).astype(np.intp)]
+        idle = np.zeros((n, 16), dtype=np.uint8)
+        idle[mode == 0, 1:] = IDLE
+        idle[mode == 1, 15] = IDLE
+        data |= idle
+
+        # slot boundaries, carrying the fractional time over
+        t = self.time + np.cumsum(np.repeat(self.periods[mode], 16))
+        ends = np.floor(t).astype(np.int64)
+        slots = np.diff(np.concatenate(([self.position], ends))).reshape(n, 16)
+        high = np.repeat(self.highs[mode], 16).reshape(n, 16)
+        if self.jitter:
+            high = high + self.rng.integers(-self.jitter, self.jitter + 1, size=(n, 16))
+            high = np.clip(high, 1, slots - DATA_DELAY)
+        low = slots - high
+        starts = np.concatenate(([self.position], ends[:-1])).reshape(n, 16)
+
+        # three runs per slot: the data of the slot before for DATA_DELAY
+        # samples, then the new data with PHI1 LO and with PHI1 HI
+        flat = data.ravel()
+        before = np.concatenate((np.array([self.last_byte], dtype=np.uint8), flat[:-1]))
+        values = np.stack((before, flat, flat | PHI1), axis=1).ravel()
+        lengths = np.stack((np.full(n * 16, DATA_DELAY), low.ravel() - DATA_DELAY,
+                            high.ravel()), axis=1).ravel()
+        samples = np.repeat(values, lengths)
+
+        if self.glitches:
+            count = self.rng.poisson(self.glitches * len(samples))
+            where = self.rng.integers(0, len(samples), size=count)
+            samples[where] ^= DATA_LINES[self.rng.integers(0, len(DATA_LINES), size=count)]
+
+        records = cycles.copy()
+        records['ss'] = starts[:, 0] + DATA_DELAY
+        records['es'] = starts[:, 15]
+        if self.first:
+            # the decoder has no cycle before the first one
+            records[0]['irg'] &= 0x7FFF
+            records[0]['ext'] &= 0x7FFF
+            records[0]['io'] &= ~digit15
+            self.first = False
+        records['opclass'] = OPCLASS_TABLE[records['irg'] >> 3]
+
+        self.time = t[-1]
+        self.position = int(ends[-1])
+        self.last_byte = flat[-1]
+        return samples, records
+
+
+def parse_modes(text):
+    # 'C200,D800': 200 CALCULATE cycles, then 800 DISPLAY cycles, repeated
+    pattern = []
+    for part in text.split(','):
+        part = part.strip().upper()
+        pattern += [{'C': 0, 'D': 1}[part[0]]] * int(part[1:] or 1)
+    return np.array(pattern, dtype=np.uint8)
+
+
+def read_words(source, rng):
+    # instruction words: 'all', 'random' or a file of hex numbers
+    if source == 'all':
+        return np.arange(8192)
+    if source == 'random':
+        return rng.integers(0, 8192, size=8192)
+    with open(source) as f:
+        return np.array([int(word, 16) for word in f.read().split()]) & 0x1FFF
+
+
+def batches(synthesizer, words, modes, cycles, payload, batch_cycles=BATCH_CYCLES):
+    # (samples, expected records) for cycles instruction cycles, taking
+    # the instruction words and modes in turn.
+    rng = synthesizer.rng
+    for start in range(0, cycles, batch_cycles):
+        index = np.arange(start, min(start + batch_cycles, cycles))
+        irg = words[index % len(words)] << 3
+        ext = np.zeros(len(index), dtype=np.int64)
+        io = np.zeros(len(index), dtype=np.uint64)
+        if payload == 'random':
+            irg |= rng.integers(0, 8, size=len(index))
+            ext = rng.integers(0, 1 << 16, size=len(index))
+            io = rng.integers(0, 1 << 63, size=len(index), dtype=np.uint64) << np.uint64(1)
+        yield synthesizer.cycles(irg, ext, io, modes[index % len(modes)])
+    yield synthesizer.finish()
+
+
+class Checker:
+    # Compares the records of a decoder with the expected ones, in order.
+    def __init__(self):
+        self.expected = np.empty(0, dtype=RECORD_DTYPE)
+        self.cycles = 0
+        self.mismatches = 0
+        self.first_mismatch = None
+
+    def expect(self, records):
+        self.expected = np.concatenate((self.expected, records))
+
+    def check(self, records):
+        n = min(len(records), len(self.expected))
+        bad = np.flatnonzero(records[:n] != self.expected[:n])
+        if len(bad) and self.first_mismatch is None:
+            self.first_mismatch = (self.expected[bad[0]], records[bad[0]])
+        self.mismatches += len(bad) + len(records) - n
+        self.cycles += len(records)
+        self.expected = self.expected[n:]
+
+
+def decode_offline(chunks, checker):
+    decoder = OfflineDecoder()
+    for samples, expected in chunks:
+        checker.expect(expected)
+        checker.check(decoder.feed(samples))
+    checker.check(decoder.flush())
+
+
+def decode_pd(chunks, checker, samplerate):
+    from . import srdmock
+    package = srdmock.install()
+    decoder = package.Decoder()
+    expected = []
+
+    def samples():
+        for samples, records in chunks:
+            expected.append(records)
+            yield samples
+
+    replay = srdmock.Replay(decoder, samples(), samplerate)
+    replay.keep = False
+    put = replay.put
+
+    def collect(ss, es, output_id, data):
+        put(ss, es, output_id, data)
+        if replay.outputs[output_id][0] == srdmock.OUTPUT_PYTHON:
+            while expected:
+                checker.expect(expected.pop(0))
+            checker.check(np.array([tuple(data[1])], dtype=RECORD_DTYPE))
+
+    decoder.put = collect
+    replay.run()
+
+
+def file_chunks(path, expected):
+    # The chunks of a written session file, the expected records all with
+    # the first one.
+    with SrFile(path) as capture:
+        records = np.concatenate(expected)
+        for samples in capture.chunks():
+            yield samples, records
+            records = records[:0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Synthesize TI-5x bus waveforms.')
+    parser.add_argument('-n', '--cycles', type=int, default=100000,
+                        help='number of instruction cycles (default: 100000)')
+    parser.add_argument('-r', '--samplerate', default='5MHz', help='default: 5MHz')
+    parser.add_argument('-c', '--clock', choices=sorted(CLOCKS), default='ti59',
+                        help='PHI1 clock of this calculator (default: ti59)')
+    parser.add_argument('-w', '--words', default='all',
+                        help="instruction words: 'all' (default), 'random' or a file of hex words")
+    parser.add_argument('-p', '--payload', choices=('random', 'zero'), default='random',
+                        help='EXT/IO words and IRG bits s0..s2 (default: random)')
+    parser.add_argument('-m', '--modes', default='C200,D800',
+                        help='mode pattern, e.g. C200,D800 (default)')
+    parser.add_argument('--jitter', type=int, default=0,
+                        help='move PHI1 rising edges by up to N samples')
+    parser.add_argument('--glitches', type=float, default=0.0,
+                        help='data line spikes per sample')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write a session file (.sr)')
+    parser.add_argument('-d', '--decode', choices=('offline', 'pd'),
+                        help='decode the samples right away and check the records')
+    args = parser.parse_args(argv)
+
+    try:
+        samplerate = parse_rate(args.samplerate)
+    except ValueError:
+        parser.error('invalid samplerate: %s' % args.samplerate)
+    try:
+        synthesizer = Synthesizer(samplerate, args.jitter, args.glitches, args.seed,
+                                  args.clock)
+    except ValueError as e:
+        parser.error(str(e))
+    words = read_words(args.words, synthesizer.rng)
+    chunks = batches(synthesizer, words, parse_modes(args.modes), args.cycles, args.payload)
+
+    begin = time.perf_counter()
+    if args.output:
+        expected = []
+
+        def samples():
+            for samples, records in chunks:
+                expected.append(records)
+                yield samples
+
+        write_sr(args.output, samples(), samplerate)
+        chunks = file_chunks(args.output, expected)
+    elapsed = time.perf_counter() - begin
+    checker = Checker()
+    if args.decode == 'offline':
+        decode_offline(chunks, checker)
+    elif args.decode == 'pd':
+        decode_pd(chunks, checker, samplerate)
+    elif not args.output:
+        for _ in chunks:
+            pass
+    if not args.output:
+        elapsed = time.perf_counter() - begin
+    print('%d samples, %d instruction cycles, %.3f s (%.1f Msamples/s)%s' % (
+        synthesizer.position, args.cycles, elapsed, synthesizer.position / elapsed / 1e6,
+        ' including decoding' if args.decode and not args.output else ''),
+        file=sys.stderr)
+    if args.decode:
+        differ = checker.mismatches + len(checker.expected)
+        print('decoded %d instruction cycles, %d differ from the input' % (
+            checker.cycles, differ), file=sys.stderr)
+        if checker.first_mismatch:
+            print('first: expected %s, decoded %s' % checker.first_mismatch, file=sys.stderr)
+        if differ:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()